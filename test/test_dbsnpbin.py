@@ -0,0 +1,85 @@
+""" the binary dbSNP store agrees with tabix on the dbSNP VCF """
+import os
+import random
+import subprocess
+
+import pytest
+
+from transvar import tabix
+from transvar.localdb import DbsnpBin, bgzip_path, tabix_path
+from transvar.utils import tabix_query
+
+
+def write_vcf(fn, recs):
+
+    """ bgzip and tabix index (as dbSNP is distributed) the records """
+    text = '##fileformat=VCFv4.0\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    text += ''.join('%s\t%d\t%s\t%s\t%s\t.\t.\tRS=%s\n' % (c, p, rs, ref, alt, rs[2:])
+                    for c, p, rs, ref, alt in recs)
+    with open(fn, 'wb') as fh:
+        p = subprocess.Popen(bgzip_path, stdout=fh, stdin=subprocess.PIPE)
+        p.communicate(input=text.encode('utf-8'))
+    subprocess.check_call([tabix_path, '-f', '-p', 'vcf', fn])
+
+
+def random_recs(rng, n):
+
+    recs = []
+    for c in ['1', '2', '10', 'X']:
+        pos = 0
+        for k in range(n):
+            # repeated positions, e.g., an SNV and an indel at the same base
+            pos += rng.choice([0, 0, 1, 2, 7, 300])
+            pos = max(pos, 1)
+            ref = rng.choice(['A', 'C', 'GT', 'TTA'])
+            recs.append((c, pos, 'rs%d' % len(recs), ref, rng.choice(['G', 'T,C', 'A'])))
+    return recs
+
+
+def tabix_at(tb, chrm, pos):
+    return [fields[:5] for fields in tabix_query(tb, chrm, pos, pos) if int(fields[1]) == pos]
+
+
+@pytest.mark.parametrize('batch', [1<<20, 7])
+def test_at_as_tabix(tmp_path, batch):
+
+    rng = random.Random(22)
+    recs = random_recs(rng, 500)
+    vcf = str(tmp_path / 'dbsnp.vcf.gz')
+    write_vcf(vcf, recs)
+    DbsnpBin.write(vcf, vcf+'.snp_bin', batch=batch)
+    assert sorted(os.listdir(str(tmp_path))) == ['dbsnp.vcf.gz', 'dbsnp.vcf.gz.snp_bin', 'dbsnp.vcf.gz.tbi']
+
+    db = DbsnpBin(vcf+'.snp_bin')
+    tb = tabix.open(vcf)
+    poses = set((c, p) for c, p, rs, ref, alt in recs)
+    for c, p in list(poses) + [(c, p+1) for c, p in poses] + [('Y', 10), ('1', 0)]:
+        assert db.at(c, p) == tabix_at(tb, c, p), (c, p)
+    assert any(len(db.at(c, p)) > 1 for c, p in poses)
+    assert db.is_current(vcf)
+    db.close()
+
+
+def test_touched_vcf(tmp_path):
+
+    vcf = str(tmp_path / 'dbsnp.vcf.gz')
+    write_vcf(vcf, random_recs(random.Random(1), 10))
+    DbsnpBin.write(vcf, vcf+'.snp_bin')
+    db = DbsnpBin(vcf+'.snp_bin')
+    assert db.is_current(vcf)
+    st = os.stat(vcf)
+    os.utime(vcf, ns=(st.st_atime_ns, st.st_mtime_ns+1000000000))
+    assert not db.is_current(vcf)
+    db.close()
+
+
+@pytest.mark.parametrize('recs', [
+    [('1', 10, 'rs1', 'A', 'G'), ('1', 5, 'rs2', 'A', 'G')],
+    [('1', 10, 'rs1', 'A', 'G'), ('2', 5, 'rs2', 'A', 'G'), ('1', 20, 'rs3', 'A', 'G')]])
+def test_unsorted(tmp_path, recs):
+
+    vcf = str(tmp_path / 'dbsnp.vcf')
+    with open(vcf, 'w') as fh:
+        fh.write(''.join('%s\t%d\t%s\t%s\t%s\t.\t.\t.\n' % r for r in recs))
+    with pytest.raises(SystemExit):
+        DbsnpBin.write(vcf, vcf+'.snp_bin')
@@ -0,0 +1,57 @@
+""" reference genomes shared with forked workers """
+import multiprocessing
+import random
+
+from transvar import faidx
+from transvar.output import BgzfWriter
+
+# long enough for several BGZF blocks and reference cache blocks
+SEQ = ''.join(random.Random(17).choices('ACGT', k=400000))
+
+
+def write_fasta(tmp_path, bgzip=False):
+
+    fa = tmp_path / ('ref.fa.gz' if bgzip else 'ref.fa')
+    text = '>chr1\n' + ''.join(SEQ[i:i+60]+'\n' for i in range(0, len(SEQ), 60))
+    if bgzip:
+        with open(str(fa), 'wb') as fh:
+            w = BgzfWriter(fh)
+            w.write(text.encode('ascii'))
+            w.close()
+    else:
+        fa.write_text(text)
+    (tmp_path / (fa.name+'.fai')).write_text('chr1\t%d\t6\t60\t61\n' % len(SEQ))
+    return str(fa)
+
+
+def _worker_fetch(args):
+
+    # as AnnoDB does in a worker, then read where the parent has not
+    fa, beg = args
+    faidx.init_refgenome(fa)
+    return [faidx.getseq('chr1', p, p+99) for p in range(beg, beg+50000, 5000)]
+
+
+def check_workers(fa):
+
+    faidx.init_refgenome(fa)
+    try:
+        assert faidx.getseq('chr1', 1, 100) == SEQ[:100]
+        begs = list(range(1001, 350000, 50000))
+        with multiprocessing.get_context('fork').Pool(3) as pool:
+            results = pool.map(_worker_fetch, [(fa, beg) for beg in begs], chunksize=1)
+        for beg, seqs in zip(begs, results):
+            assert seqs == [SEQ[p-1:p+99] for p in range(beg, beg+50000, 5000)]
+        # the parent reads on, at offsets the workers have not read
+        for p in [399001, 3001, 201234]:
+            assert faidx.getseq('chr1', p, p+199) == SEQ[p-1:p+199]
+    finally:
+        faidx.close_refgenome()
+
+
+def test_workers_share_fasta(tmp_path):
+    check_workers(write_fasta(tmp_path))
+
+
+def test_workers_share_bgzipped_fasta(tmp_path):
+    check_workers(write_fasta(tmp_path, bgzip=True))
@@ -0,0 +1,122 @@
+""" the merged feature store finds what the tracks find with tabix """
+import configparser
+import os
+import random
+
+from transvar import tabix
+from transvar.annodb import AnnoDB
+from transvar.localdb import FeatureDB, FeatureBin
+from transvar.utils import tabix_query
+
+CHRMS = ['chr1', 'chr2', 'chr10']
+
+
+def write_tracks(d, rng, n=300):
+
+    """ a BED (with zero-length features), a GFF and a VCF track,
+    indexed as .featuredb """
+    bed = ''
+    gff = ''
+    vcf = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    for k in range(n):
+        chrm = rng.choice(CHRMS)
+        beg = rng.randrange(0, 5000)
+        bed += '%s\t%d\t%d\tbed%d\n' % (chrm, beg, beg+rng.choice([0, 0, 1, 5, 300]), k)
+        beg = rng.randrange(1, 5000)
+        gff += '%s\tsrc\tgff%d\t%d\t%d\t.\t+\t.\tID=%d\n' % (chrm, k, beg, beg+rng.randrange(0, 200), k)
+        vcf += '%s\t%d\trs%d\t%s\tA\t.\t.\t.\n' % (chrm, rng.randrange(1, 5000), k, rng.choice(['C', 'GT', 'TTAC']))
+    features = []
+    for rname, raw_format, text in [('a', 'bed', bed), ('b', 'gff', gff), ('c', 'vcf', vcf)]:
+        fn = os.path.join(d, rname+'.'+raw_format)
+        with open(fn, 'w') as fh:
+            fh.write(text)
+        FeatureDB().index(fn, raw_format, False)
+        features.append((rname, fn+'.featuredb'))
+    return features
+
+
+def tabix_overlap(features, chrm, beg, end):
+
+    """ the per-track loop of AnnoDB.query_feature without the merged store """
+    return [(rname, fields) for rname, featdb in features
+            for fields in tabix_query(tabix.open(featdb), chrm, beg, end)]
+
+
+def queries(rng):
+
+    for k in range(500):
+        chrm = rng.choice(CHRMS + ['chrX'])
+        beg = rng.randrange(-5, 5300)
+        # single bases, ranges and inverted ranges
+        yield chrm, beg, beg + rng.choice([0, 0, 1, 10, 400, -1, -20])
+
+
+def test_overlap_as_tabix(tmp_path):
+
+    rng = random.Random(23)
+    features = write_tracks(str(tmp_path), rng)
+    merged = str(tmp_path / 'hg19.featuremerge')
+    FeatureBin.write(features, merged)
+    fb = FeatureBin(merged)
+    assert fb.is_current(features)
+    nhits = 0
+    for chrm, beg, end in queries(rng):
+        hits = fb.overlap(chrm, beg, end)
+        assert hits == tabix_overlap(features, chrm, beg, end), (chrm, beg, end)
+        nhits += len(hits)
+    assert nhits > 0
+    fb.close()
+
+
+class Record():
+
+    def __init__(self):
+        self.info = []
+
+    def append_info(self, info):
+        self.info.append(info)
+
+
+def annodb(features, merged):
+
+    """ the feature resources of an AnnoDB with the tracks configured """
+    cfg = configparser.RawConfigParser()
+    cfg.add_section('hg19')
+    for rname, featdb in features:
+        cfg.set('hg19', rname, featdb)
+    cfg.set('hg19', 'featuremerge', merged)
+    db = AnnoDB.__new__(AnnoDB)
+    db.config = cfg
+    db.rv = 'hg19'
+    db.resources = {}
+    db.init_resource()
+    return db
+
+
+def test_reindexed_track(tmp_path):
+
+    rng = random.Random(123)
+    features = write_tracks(str(tmp_path), rng)
+    merged = str(tmp_path / 'hg19.featuremerge')
+    FeatureBin.write(features, merged)
+    assert annodb(features, merged).feature_bin is not None
+
+    # a re-indexed track with one more feature
+    bed = str(tmp_path / 'a.bed')
+    with open(bed, 'a') as fh:
+        fh.write('chr2\t7000\t7010\tnew\n')
+    FeatureDB().index(bed, 'bed', False)
+    fb = FeatureBin(merged)
+    assert not fb.is_current(features)
+    fb.close()
+
+    db = annodb(features, merged)
+    assert db.feature_bin is None
+    r = Record()
+    db.query_feature(r, 'chr2', 7005, 7005)
+    assert r.info == ['[feature:a]=new|chr2:7000_7010']
+    for chrm, beg, end in queries(rng):
+        r = Record()
+        db.query_feature(r, chrm, beg, end)
+        assert r.info == ['[feature:%s]=%s|%s:%s_%s' % (rname, fields[3], fields[0], fields[1], fields[2])
+                          for rname, fields in tabix_overlap(features, chrm, beg, end)]
@@ -0,0 +1,59 @@
+""" the in-memory interval index agrees with tabix on .loc_idx """
+import random
+
+from transvar import tabix
+from transvar.localdb import TrnxLocIndex, TabixIndex
+from transvar.output import BgzfWriter
+from transvar.utils import tabix_query
+
+
+def write_loc_idx(fn, loci):
+
+    tbi = TabixIndex()
+    with open(fn, 'wb') as fh:
+        w = BgzfWriter(fh)
+        for chrm, beg, end, name in sorted(loci):
+            voff = w.tell()
+            w.write(('%s\t%d\t%d\tG\t%s\t1\tprotein_coding\t+\t%d\t%d\t[]\t\t\t0\n' % (
+                chrm, beg, end, name, beg, end)).encode('utf-8'))
+            tbi.add(chrm, beg, end, voff, w.tell())
+        w.close()
+    tbi.write(fn+'.tbi')
+
+
+def both_engines(tmp_path, loci):
+
+    fn = str(tmp_path / 'db.loc_idx')
+    write_loc_idx(fn, loci)
+    return tabix.open(fn), TrnxLocIndex.from_loc_idx(fn)
+
+
+def tabix_names(tb, chrm, beg, end):
+    return sorted(fields[4] for fields in tabix_query(tb, chrm, beg, end))
+
+
+def interval_names(idx, chrm, beg, end):
+    return sorted(item[2] for item in idx.overlap(chrm, beg, end))
+
+
+def test_inverted_range(tmp_path):
+
+    tb, idx = both_engines(tmp_path, [('chr1', 328000, 329000, 'T1')])
+    # chr1:g.328493_328494GC>GC, nothing left after trimming the common bases
+    assert tabix_names(tb, 'chr1', 328495, 328494) == []
+    assert interval_names(idx, 'chr1', 328495, 328494) == []
+    assert interval_names(idx, 'chr1', 328494, 328494) == ['T1']
+
+
+def test_random_ranges(tmp_path):
+
+    rng = random.Random(7)
+    loci = []
+    for i in range(300):
+        beg = rng.randrange(0, 200000)
+        loci.append(('chr1', beg, beg+rng.randrange(1, 20000), 'T%d' % i))
+    tb, idx = both_engines(tmp_path, loci)
+    for _ in range(2000):
+        beg = rng.randrange(-10, 220000)
+        end = beg + rng.randrange(-3, 5000)
+        assert tabix_names(tb, 'chr1', beg, end) == interval_names(idx, 'chr1', beg, end), (beg, end)
@@ -0,0 +1,56 @@
+""" transvar normalize on VCF input """
+import argparse
+from io import StringIO
+
+from transvar import faidx
+from transvar.normalize import RefWindow, _Seen, main_vcf
+from transvar.output import OutputSink, set_output
+
+HEADER = """##fileformat=VCFv4.2
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count">
+##INFO=<ID=RC,Number=R,Type=Integer,Description="Read count per allele">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Genotype likelihoods">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2
+"""
+
+
+def normalize_vcf(tmp_path, records):
+
+    seq = 'ACGT'*500
+    fa = tmp_path / 'ref.fa'
+    fa.write_text('>chr1\n' + ''.join(seq[i:i+60]+'\n' for i in range(0, len(seq), 60)))
+    (tmp_path / 'ref.fa.fai').write_text('chr1\t%d\t6\t60\t61\n' % len(seq))
+    vcf = tmp_path / 'in.vcf'
+    vcf.write_text(HEADER + ''.join('\t'.join(r)+'\n' for r in records))
+
+    faidx.init_refgenome(str(fa))
+    out = StringIO()
+    sink = OutputSink(out)
+    prev = set_output(sink)
+    try:
+        main_vcf(argparse.Namespace(vcf=str(vcf), suspend=True), RefWindow(), _Seen(False))
+        sink.close()
+    finally:
+        set_output(prev)
+        faidx.close_refgenome()
+    return [l.split('\t') for l in out.getvalue().splitlines() if not l.startswith('#')]
+
+
+def test_multiallelic_split(tmp_path):
+
+    rec = ['chr1', '1000', '.', 'T', 'TA,TC', '50', 'PASS', 'DP=10;AC=3,5;RC=1,2,3;DB',
+           'GT:AD:PL', '1/2:1,4,5:10,20,30,40,50,60', '0|2:3,0,7:0,1,2,3,4,5']
+    first, second = normalize_vcf(tmp_path, [rec])
+    assert first == ['chr1', '1000', '.', 'T', 'TA', '50', 'PASS', 'DP=10;AC=3;RC=1,2;DB',
+                     'GT:AD:PL', '1/0:1,4:10,20,30', '0|0:3,0:0,1,2']
+    assert second == ['chr1', '1000', '.', 'T', 'TC', '50', 'PASS', 'DP=10;AC=5;RC=1,3;DB',
+                      'GT:AD:PL', '0/1:1,5:10,40,60', '0|1:3,7:0,3,5']
+
+
+def test_biallelic_kept(tmp_path):
+
+    rec = ['chr1', '1001', '.', 'A', 'G', '50', 'PASS', 'AC=3', 'GT:AD', '0/1:4,5', './.:.']
+    assert normalize_vcf(tmp_path, [rec]) == [rec]
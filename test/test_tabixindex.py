@@ -0,0 +1,56 @@
+""" the tabix index written in process answers queries as tabix -p bed """
+import random
+import shutil
+import subprocess
+
+from transvar import tabix
+from transvar.localdb import TabixIndex, tabix_path
+from transvar.output import BgzfWriter
+from transvar.utils import tabix_query
+
+CHRMS = [('chr1', 3000000), ('chr2', 200000), ('chr10', 40000000)]
+
+
+def bed_lines(rng, n=3000):
+
+    """ sorted BED records, with zero-length features and features
+    spanning several bins """
+    lines = []
+    for chrm, size in CHRMS:
+        begs = sorted(rng.randrange(0, size) for k in range(n))
+        for k, beg in enumerate(begs):
+            end = beg + rng.choice([0, 0, 1, 10, 1000, 20000, 300000, 2000000])
+            lines.append('%s\t%d\t%d\tf%d\n' % (chrm, beg, end, k))
+    return lines
+
+
+def test_query_as_tabix(tmp_path):
+
+    rng = random.Random(24)
+    fn = str(tmp_path / 'a.bed.gz')
+    tbi = TabixIndex()
+    with open(fn, 'wb') as fh:
+        w = BgzfWriter(fh)
+        for line in bed_lines(rng):
+            fields = line.split('\t', 3)
+            voff = w.tell()
+            w.write(line.encode('utf-8'))
+            tbi.add(fields[0], int(fields[1]), int(fields[2]), voff, w.tell())
+        w.close()
+    tbi.write(fn+'.tbi')
+
+    fn2 = str(tmp_path / 'b.bed.gz')
+    shutil.copy(fn, fn2)
+    subprocess.check_call([tabix_path, '-p', 'bed', fn2])
+
+    tb = tabix.open(fn)
+    tb2 = tabix.open(fn2)
+    nhits = 0
+    for k in range(1000):
+        chrm, size = rng.choice(CHRMS + [('chrX', 1000)])
+        beg = rng.randrange(0, size)
+        end = beg + rng.choice([0, 0, 1, 100, 50000, 1000000, -1])
+        hits = list(tabix_query(tb, chrm, beg, end))
+        assert hits == list(tabix_query(tb2, chrm, beg, end)), (chrm, beg, end)
+        nhits += len(hits)
+    assert nhits > 0
@@ -0,0 +1,63 @@
+""" binary transcript records decode as the text .transvardb rows """
+from transvar.localdb import GENCODEDB, TransVarDB
+
+FIELDS = ['gene_name', 'name', 'version', 'transcript_type', 'beg', 'end', 'chrm',
+          'strand', 'cds_beg', 'cds_end', 'exons', 'aliases', 'gene_dbxref']
+
+
+def gtf_line(chrm, feature, beg, end, strand, attrs):
+    return '%s\tHAVANA\t%s\t%d\t%d\t.\t%s\t.\t%s\n' % (
+        chrm, feature, beg, end, strand, ' '.join('%s "%s";' % kv for kv in attrs))
+
+
+def write_gtf(fn):
+
+    lines = []
+    k = 0
+    for chrm in ['chr1', 'chr2']:
+        for g, strand in enumerate('+-+'):
+            gbeg = 1000 + 20000*g
+            gene = [('gene_id', 'ENSG%011d.1' % k), ('gene_type', 'protein_coding'),
+                    ('gene_name', 'GENE%d' % k)]
+            lines.append(gtf_line(chrm, 'gene', gbeg, gbeg+9000, strand, gene))
+            for t in range(2):
+                coding = t == 0
+                tattrs = gene + [('transcript_id', 'ENST%011d.%d' % (k*10+t, t+1)),
+                                 ('transcript_type', 'protein_coding' if coding else 'lincRNA')]
+                exons = [(gbeg+3000*e+t*10, gbeg+3000*e+500) for e in range(3-t)]
+                if coding:
+                    tattrs.append(('protein_id', 'ENSP%011d.1' % (k*10+t)))
+                lines.append(gtf_line(chrm, 'transcript', exons[0][0], exons[-1][1], strand, tattrs))
+                for beg, end in exons:
+                    lines.append(gtf_line(chrm, 'exon', beg, end, strand, tattrs))
+                    if coding:
+                        lines.append(gtf_line(chrm, 'CDS', beg+100, end-100, strand, tattrs))
+            k += 1
+
+    with open(fn, 'w') as fh:
+        fh.write(''.join(lines))
+
+
+def test_trnx_bin_round_trip(tmp_path):
+
+    gtf = str(tmp_path / 'test.gtf')
+    write_gtf(gtf)
+    GENCODEDB().index([gtf])
+
+    db = TransVarDB(gtf+'.transvardb')
+    assert db.trnx_bin is not None
+    # the text rows, as parse_all reads them without the binary store
+    db.dbfh.seek(0)
+    texts = []
+    while True:
+        t = next(db.parse_trnx(), None)
+        if t is None:
+            break
+        texts.append(t)
+    assert len(texts) == len(db.trnx_bin) == 12
+    for i, t in enumerate(texts):
+        b = db.trnx_bin.decode(i)
+        assert [getattr(b, f) for f in FIELDS] == [getattr(t, f) for f in FIELDS]
+        assert db.trnx_bin.locus(i) == (t.chrm, t.beg, t.end, t.name)
+    assert sorted(t.strand for t in texts) == ['+']*8 + ['-']*4
+    assert any(t.aliases for t in texts) and any(not t.aliases for t in texts)
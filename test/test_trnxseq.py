@@ -0,0 +1,79 @@
+""" stored CDS and protein sequences are only used with their reference """
+import random
+
+from transvar import faidx
+from transvar.localdb import GENCODEDB, TransVarDB
+from transvar.output import BgzfWriter
+
+from test_trnxbin import write_gtf
+
+CHRMS = [('chr1', 60000), ('chr2', 60000)]
+
+
+def write_fasta(fn, chrm2seq, bgzip=False):
+
+    text = ''
+    fai = ''
+    for chrm, seq in chrm2seq:
+        fai += '%s\t%d\t%d\t60\t61\n' % (chrm, len(seq), len(text)+len(chrm)+2)
+        text += '>%s\n' % chrm + ''.join(seq[i:i+60]+'\n' for i in range(0, len(seq), 60))
+    with open(fn, 'wb') as fh:
+        if bgzip:
+            w = BgzfWriter(fh)
+            w.write(text.encode('ascii'))
+            w.close()
+        else:
+            fh.write(text.encode('ascii'))
+    with open(fn+'.fai', 'w') as fh:
+        fh.write(fai)
+    return fn
+
+
+def build(tmp_path):
+
+    rng = random.Random(18)
+    chrm2seq = [(chrm, ''.join(rng.choices('ACGT', k=n))) for chrm, n in CHRMS]
+    ref = write_fasta(str(tmp_path / 'ref.fa'), chrm2seq)
+    gtf = str(tmp_path / 'test.gtf')
+    write_gtf(gtf)
+    faidx.init_refgenome(ref)
+    try:
+        GENCODEDB().index([gtf], store_seq=True)
+    finally:
+        faidx.close_refgenome()
+    return gtf+'.transvardb', chrm2seq
+
+
+def stored_seq_used(dbfn, ref):
+
+    faidx.init_refgenome(ref)
+    try:
+        return TransVarDB(dbfn).trnx_seq is not None
+    finally:
+        faidx.close_refgenome()
+
+
+def test_same_reference(tmp_path):
+
+    dbfn, chrm2seq = build(tmp_path)
+    assert stored_seq_used(dbfn, str(tmp_path / 'ref.fa'))
+    # a bgzipped copy of the same reference
+    refz = write_fasta(str(tmp_path / 'refz.fa.gz'), chrm2seq, bgzip=True)
+    assert stored_seq_used(dbfn, refz)
+
+
+def test_masked_reference(tmp_path):
+
+    dbfn, chrm2seq = build(tmp_path)
+    # same names and lengths, GENE4 on chr2 masked as in analysis sets
+    chrm, seq = chrm2seq[1]
+    chrm2seq[1] = (chrm, seq[:20000] + 'N'*10000 + seq[30000:])
+    masked = write_fasta(str(tmp_path / 'masked.fa'), chrm2seq)
+    assert not stored_seq_used(dbfn, masked)
+
+
+def test_other_assembly(tmp_path):
+
+    dbfn, chrm2seq = build(tmp_path)
+    other = write_fasta(str(tmp_path / 'other.fa'), [(c, s+'ACGT') for c, s in chrm2seq])
+    assert not stored_seq_used(dbfn, other)
@@ -29,6 +29,9 @@ SOFTWARE.
 
 import sys, argparse, re
 from .annodb import AnnoDB
+from .parallel import parallel_main_list
+from .output import init_output, write_line
+from . import faidx
 # from transcripts import *
 from .parser import parser_add_annotation
 # import parser
@@ -194,22 +197,41 @@ def main_one(args, db, at):
 def main(args, at):
 
     config = read_config()
-    db = AnnoDB(args, config)
+    if args.vcf and at != 'g':
+        err_raise("can apply on ganno to VCF input")
 
+    init_output(args)
     if (not args.vcf) and (not args.noheader):
-        print(print_header())
+        write_line(print_header())
+
+    if args.jobs > 1 and (args.l or args.vcf):
+        # workers open their own databases
+        process = partial(main_list, at=at)
+        if args.l:
+            parallel_main_list(args, list_parse_mutation(args, at), process)
+        if args.vcf:
+            parallel_main_list(args, vcf_parse_mutation(args, 'g'), process)
+        if not args.i:
+            return
+
+    db = AnnoDB(args, config)
 
-    if args.l:
+    if args.l and args.jobs <= 1:
         main_list(args, db, at, list_parse_mutation(args, at))
 
-    if args.vcf:
-        if at != 'g':
-            err_raise("can apply on ganno to VCF input")
+    if args.vcf and args.jobs <= 1:
         main_list(args, db, at, vcf_parse_mutation(args, 'g'))
 
     if args.i:
         main_one(args, db, at)
 
+    if args.verbose > 0 and db.tcache is not None:
+        err_print(db.tcache.stats())
+    if args.verbose > 0 and faidx.seqcache is not None:
+        err_print(faidx.seqcache.stats())
+    if args.verbose > 0 and db.dbsnp_sweep is not None:
+        err_print(db.dbsnp_sweep.stats())
+
 def parser_add_general(parser):
 
     parser.add_argument('--suspend', 
@@ -28,9 +28,149 @@ SOFTWARE.
 """
 
 from .transcripts import *
-from .localdb import TransVarDB
+from .localdb import TransVarDB, DbsnpBin, FeatureBin
 from . import parser
 from pickle import load
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+
+def transcript_memsize(t):
+
+    """ rough estimate of the memory (bytes) held by a transcript: the object
+    and its exons, the CDS, whether retrieved from the reference or copied
+    from the stored sequences (see TrnxSeq), and the PositionMap once built.
+    Stored proteins are read from the mapped .trxn_seq at each use and are
+    not held by the transcript. """
+    size = 1000 + 64*len(t.exons)
+    if t.seq:
+        size += len(t.seq)
+    np = getattr(t, 'np', None)
+    if np is not None:
+        # begs, ends, cumlen and keys of the coding segments
+        size += 300 + 32*len(np.begs)
+    return size
+
+class TranscriptCache():
+
+    """ LRU cache of parsed transcripts shared across queries
+    Transcripts are keyed by source, name, version and location (transcript
+    names are not always unique) and keep the CDS and the PositionMap
+    retrieved by previous queries. The transcripts returned since the last
+    call are re-measured at each call since their sequence is retrieved
+    lazily; the least recently used are evicted beyond the memory budget.
+    """
+
+    def __init__(self, maxsize):
+
+        self.maxsize = maxsize
+        self.key2tpt = OrderedDict()
+        self.key2size = {}
+        self.size = 0
+        self.touched = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, t):
+
+        """ return the cached transcript equal to t, cache t if absent """
+        self._remeasure()
+        k = (t.source, t.name, t.version, t.chrm, t.beg, t.end)
+        if k in self.key2tpt:
+            self.hits += 1
+            t = self.key2tpt.pop(k)
+            self.key2tpt[k] = t
+        else:
+            self.misses += 1
+            self.key2tpt[k] = t
+            self.key2size[k] = transcript_memsize(t)
+            self.size += self.key2size[k]
+            self._evict()
+        self.touched.append(k)
+        return t
+
+    def _remeasure(self):
+        for k in self.touched:
+            if k in self.key2tpt:
+                size = transcript_memsize(self.key2tpt[k])
+                self.size += size - self.key2size[k]
+                self.key2size[k] = size
+        self.touched = []
+
+    def _evict(self):
+        while self.size > self.maxsize and len(self.key2tpt) > 1:
+            k, t = self.key2tpt.popitem(last=False)
+            self.size -= self.key2size.pop(k)
+            self.evictions += 1
+
+    def stats(self):
+        return 'transcript cache: %d hits, %d misses, %d evictions, %d transcripts (%1.1f MB)' % (
+            self.hits, self.misses, self.evictions, len(self.key2tpt), self.size/1048576.)
+
+class DbsnpSweep():
+
+    """ dbSNP records for a coordinate-sorted stream of queries
+    Instead of a tabix query per lookup, one tabix iterator per chromosome
+    is read forward alongside the queries (a merge join). Records are kept
+    for a look-back window of lookback bp, so that lookups slightly out of
+    order (anchors of indels, bases of a codon on the '-' strand) are still
+    served. A lookup behind the window is a plain tabix query; one far ahead
+    (more than jump bp) restarts the iterator there.
+    """
+
+    def __init__(self, tb, lookback=1000, jump=100000):
+
+        self.tb = tb
+        self.lookback = lookback
+        self.jump = jump
+        self.chrm = None
+        self.seeks = 0
+        self.lookups = 0
+        self.fallbacks = 0
+
+    def seek(self, chrm, pos):
+
+        self.seeks += 1
+        self.chrm = chrm
+        self.lo = max(1, pos-self.lookback) # complete from lo on
+        self.it = iter(tabix_query(self.tb, chrm, self.lo, 1<<29))
+        self.last = self.lo - 1             # position of the last record read
+        self.poses = []
+        self.recs = []
+
+    def at(self, chrm, pos):
+
+        """ the records (as split fields) at pos, in file order """
+        self.lookups += 1
+        if chrm != self.chrm or pos > self.last + self.jump:
+            self.seek(chrm, pos)
+        elif pos < self.lo:
+            self.fallbacks += 1
+            return [fields for fields in tabix_query(self.tb, chrm, pos, pos)
+                    if int(fields[1]) == pos]
+
+        while self.last <= pos:
+            fields = next(self.it, None)
+            if fields is None:
+                self.last = float('inf')
+                break
+            self.last = int(fields[1])
+            self.poses.append(self.last)
+            self.recs.append(fields)
+
+        # slide the look-back window, trimming the buffer in batches
+        if pos - self.lookback > self.lo:
+            self.lo = pos - self.lookback
+            k = bisect_left(self.poses, self.lo)
+            if k > 1024:
+                del self.poses[:k]
+                del self.recs[:k]
+
+        return self.recs[bisect_left(self.poses, pos):bisect_right(self.poses, pos)]
+
+    def stats(self):
+        return 'dbSNP sweep: %d lookups, %d seeks, %d look-back misses' % (
+            self.lookups, self.seeks, self.fallbacks)
 
 class AnnoDB():
 
@@ -50,27 +190,24 @@ class AnnoDB():
         
         faidx.init_refgenome(args.reference if args.reference else None)
         self.session = None
-        self.name2gene = {}
-        self.name2trnx = {}
-        self.thash = None
 
         self.dbs = []
         if args.ensembl:
-            self.dbs.append(TransVarDB(args.ensembl, source='Ensembl'))
+            self.dbs.append(TransVarDB(args.ensembl, source='Ensembl', loc_engine=args.loc_engine))
         if args.gencode:
-            self.dbs.append(TransVarDB(args.gencode, source='GENCODE'))
+            self.dbs.append(TransVarDB(args.gencode, source='GENCODE', loc_engine=args.loc_engine))
         if args.kg:
-            self.dbs.append(TransVarDB(args.kg, source='KnownGene'))
+            self.dbs.append(TransVarDB(args.kg, source='KnownGene', loc_engine=args.loc_engine))
         if args.ucsc:
-            self.dbs.append(TransVarDB(args.ucsc, source='UCSCRefGene'))
+            self.dbs.append(TransVarDB(args.ucsc, source='UCSCRefGene', loc_engine=args.loc_engine))
         if args.refseq:
-            self.dbs.append(TransVarDB(args.refseq, source='RefSeq'))
+            self.dbs.append(TransVarDB(args.refseq, source='RefSeq', loc_engine=args.loc_engine))
         if args.ccds:
-            self.dbs.append(TransVarDB(args.ccds, source='CCDS'))
+            self.dbs.append(TransVarDB(args.ccds, source='CCDS', loc_engine=args.loc_engine))
         if args.aceview:
-            self.dbs.append(TransVarDB(args.aceview, source='AceView'))
+            self.dbs.append(TransVarDB(args.aceview, source='AceView', loc_engine=args.loc_engine))
         if args.kg:
-            self.dbs.append(TransVarDB(args.kg, source='KnownGene'))
+            self.dbs.append(TransVarDB(args.kg, source='KnownGene', loc_engine=args.loc_engine))
 
         if args.uniprot:
             idmap = load(open(args.uniprot, 'rb'))
@@ -81,26 +218,36 @@ class AnnoDB():
         self.resources = {}
         self.init_resource()
 
-        # The following in-memory processing is unfinished
-        # One needs to handle integratively transcript ID
-        # input and gene ID input. NOT necessary.
-        # The speed-up may not worth the effort.
-        if args.mem:
+        # in-memory processing, by default for list and VCF inputs
+        self.tcache = None
+        if args.mem or (not args.nomem and (args.l or args.vcf)):
             for db in self.dbs:
-                db.parse_all(self.name2gene, self.name2trnx)
-
-            self.thash = THash()
-            genes = set(self.name2gene.values())
-            for g in genes:
-                for t in g.tpts:
-                    self.thash.insert(t)
+                db.load_all()
+        elif args.tcache > 0:
+            # otherwise keep recently used transcripts across queries
+            self.tcache = TranscriptCache(args.tcache*1048576)
+            for db in self.dbs:
+                db.cache = self.tcache
 
     def init_resource(self):
         """ init features and other annotation resources """
+        self.dbsnp_sweep = None
+        self.dbsnp_bin = None
+        from . import tabix
         for rname in ['dbsnp']:
             if self.config.has_option(self.rv, 'dbsnp'):
-                from . import tabix
-                self.resources['dbsnp'] = tabix.open(self.config.get(self.rv, 'dbsnp'))
+                dbsnp = self.config.get(self.rv, 'dbsnp')
+                self.resources['dbsnp'] = tabix.open(dbsnp)
+                # binary store from transvar index --dbsnp
+                if os.path.exists(dbsnp+'.snp_bin'):
+                    self.dbsnp_bin = DbsnpBin(dbsnp+'.snp_bin')
+                    if not self.dbsnp_bin.is_current(dbsnp):
+                        err_warn('%s.snp_bin is outdated, please rerun transvar index --dbsnp' % dbsnp)
+                        self.dbsnp_bin.close()
+                        self.dbsnp_bin = None
+                # sorted input, join with dbSNP in one forward sweep
+                if self.dbsnp_bin is None and (self.args.sorted_input or self.args.vcf):
+                    self.dbsnp_sweep = DbsnpSweep(self.resources['dbsnp'])
 
         self.features = []
         for rname in self.config.options(self.rv):
@@ -108,20 +255,62 @@ class AnnoDB():
             if featdb.endswith('.featuredb'):
                 self.features.append((rname,tabix.open(featdb)))
 
+        # merged tracks from transvar index --merge-features
+        self.feature_bin = None
+        if self.features and self.config.has_option(self.rv, 'featuremerge'):
+            merged = self.config.get(self.rv, 'featuremerge')
+            features = [(rname, self.config.get(self.rv, rname)) for rname, feat in self.features]
+            if os.path.exists(merged):
+                self.feature_bin = FeatureBin(merged)
+                if not self.feature_bin.is_current(features):
+                    err_warn('%s is outdated, please rerun transvar index --merge-features' % merged)
+                    self.feature_bin.close()
+                    self.feature_bin = None
+
+    def reopen(self):
+
+        """ new handles for the files read through a file offset, which a
+        forked worker would share with the parent, mappings are kept """
+        from . import tabix
+        for db in self.dbs:
+            db.reopen()
+        if 'dbsnp' in self.resources:
+            self.resources['dbsnp'] = tabix.open(self.config.get(self.rv, 'dbsnp'))
+            if self.dbsnp_sweep is not None:
+                self.dbsnp_sweep = DbsnpSweep(self.resources['dbsnp'])
+        self.features = [(rname, tabix.open(self.config.get(self.rv, rname)))
+                         for rname, feat in self.features]
+
     def query_feature(self, r, chrm, beg, end):
         """ find all the dbsnp in a range """
+        if self.feature_bin is not None:
+            for rname, fields in self.feature_bin.overlap(chrm, int(beg), int(end)):
+                r.append_info('[feature:%s]=%s|%s:%s_%s' %
+                              (rname, fields[3], fields[0], fields[1], fields[2]))
+            return
+
         for rname, feat in self.features:
             for fields in tabix_query(feat, chrm, int(beg), int(end)):
                 r.append_info('[feature:%s]=%s|%s:%s_%s' %
                               (rname, fields[3], fields[0], fields[1], fields[2]))
 
+    def _dbsnp_at(self, chrm, pos, beg, end):
+
+        """ dbSNP records overlapping beg to end, those not at pos
+        may be left out """
+        if self.dbsnp_bin is not None:
+            return self.dbsnp_bin.at(normalize_chrm_dbsnp(chrm), pos)
+        if self.dbsnp_sweep is not None:
+            return self.dbsnp_sweep.at(normalize_chrm_dbsnp(chrm), pos)
+        return tabix_query(
+            self.resources['dbsnp'], normalize_chrm_dbsnp(chrm), beg, end)
+
     def _query_dbsnp_(self, chrm, beg, end, ref=None, alt=None):
 
         dbsnps = []
         if 'dbsnp' in self.resources:
             if beg == end and (alt is None or len(alt)==1): # SNV
-                ret = tabix_query(
-                    self.resources['dbsnp'], normalize_chrm_dbsnp(chrm), int(beg), int(end))
+                ret = self._dbsnp_at(chrm, int(beg), int(beg), int(end))
                 for fields in ret:
                     if int(fields[1]) != int(beg):
                         continue
@@ -136,8 +325,7 @@ class AnnoDB():
                     else:
                         dbsnps.append('%s(%s:%s%s>%s)' % (fields[2], chrm, fields[1], fields[3], alt))
             else:               # indels and mnv
-                ret = tabix_query(
-                    self.resources['dbsnp'], normalize_chrm_dbsnp(chrm), int(beg)-1, int(end))
+                ret = self._dbsnp_at(chrm, int(beg)-1, int(beg)-1, int(end))
                 for fields in ret:
                     if int(fields[1]) != int(beg)-1:
                         continue
@@ -30,6 +30,8 @@ import sys, re, argparse
 from .mutation import parser_add_mutation, parse_tok_mutation_str, list_parse_mutation
 from .parser import parser_add_annotation
 from .annodb import AnnoDB
+from .parallel import parallel_main_list
+from .output import init_output, write_line
 from .transcripts import *
 from .err import *
 from .utils import *
@@ -76,13 +78,11 @@ def _main_core_(args, q, db):
         else: s = ''
         s += outformat.format(altid=altid, tptstr=','.join(tpairs), chrm=chrm,
                               codon1='-'.join(map(str,c1)), codon2='-'.join(map(str,c2)))
-        print(s)
+        write_line(s)
 
-def main_list(args, db): #name2gene, thash):
+def main_list(args, db, mutation_parser): #name2gene, thash):
 
-    if not args.noheader:
-        print('origin_id\talt_id\tchrm\tcodon1\tcodon2\ttranscripts_choice')
-    for q, line in list_parse_mutation(args, 'p'):
+    for q, line in mutation_parser:
 
         genefound = False
         for q.gene in db.get_gene(q.tok):
@@ -100,7 +100,7 @@ def main_list(args, db): #name2gene, thash):
 def main_one(args, db): #name2gene, thash):
 
     if not args.noheader:
-        print('origin_id\talt_id\tchrm\tcodon1\tcodon2\ttranscripts_choice')
+        write_line('origin_id\talt_id\tchrm\tcodon1\tcodon2\ttranscripts_choice')
     q = parse_tok_mutation_str(args.i, 'p')
     q.op = args.i
     genefound = False
@@ -116,11 +116,21 @@ def main_one(args, db): #name2gene, thash):
 def main(args):
 
     config = read_config()
+    init_output(args)
+    if args.l:
+        if not args.noheader:
+            write_line('origin_id\talt_id\tchrm\tcodon1\tcodon2\ttranscripts_choice')
+        if args.jobs > 1:
+            # workers open their own databases
+            parallel_main_list(args, list_parse_mutation(args, 'p'), main_list)
+            if not args.i:
+                return
+
     db = AnnoDB(args, config)
     # name2gene, thash = parse_annotation(args)
 
-    if args.l:
-        main_list(args, db) #name2gene, thash)
+    if args.l and args.jobs <= 1:
+        main_list(args, db, list_parse_mutation(args, 'p')) #name2gene, thash)
     if args.i:
         main_one(args, db) #name2gene, thash)
 
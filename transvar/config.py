@@ -239,6 +239,15 @@ def config_set(config, section, option, value):
         config.add_section(section)
     config.set(section, option, value)
 
+def save_config(config):
+
+    for cfg_fn in cfg_fns:
+        try:
+            config.write(open(cfg_fn,'w'))
+            break
+        except IOError as e:
+            pass
+
 def _download_(config, section, fns):
 
     for pdir in downloaddirs:
@@ -435,12 +444,7 @@ $ transvar config -k reference -v [path_to_fa] --refversion [build_name]
             config.set('DEFAULT', 'refversion', args.refversion)
 
     if config_altered:
-        for cfg_fn in cfg_fns:
-            try:
-                config.write(open(cfg_fn,'w'))
-                break
-            except IOError as e:
-                pass
+        save_config(config)
     else:
         print_current(args)
 
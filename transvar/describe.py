@@ -90,11 +90,10 @@ def describe_intergenic_site(args, db, chrm, beg=None, end=None, pos=None, tu=No
         beg = pos
         end = pos
 
-    _tu, _td = db.get_closest_transcripts(chrm, beg, end)
     if tu is None:
-        tu = _tu
+        tu = db.get_closest_transcripts_upstream(chrm, beg)
     if td is None:
-        td = _td
+        td = db.get_closest_transcripts_downstream(chrm, end)
 
     site = RegIntergenicAnno()
     if tu:
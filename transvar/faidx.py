@@ -1,29 +1,247 @@
 """ faidx python code adapted from Allen Yu
 http://www.allenyu.info/item/24-quickly-fetch-sequence-from-samtools-faidx-indexed-fasta-sequences.html """
+import re
+import os
 import sys
 import mmap
+import zlib
+import struct
+import weakref
+import threading
+from collections import OrderedDict
+from array import array
+from bisect import bisect_right
 
 from .err import *
 from .utils import *
 
+# upper-casing table for bytes.translate
+_upper = bytes.maketrans(b'abcdefghijklmnopqrstuvwxyz', b'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+
+# 2-bit encoding (T, C, A, G), other bases are coded as T and kept as N blocks
+_twobit_sig = 0x1A412743
+_twobit_enc = bytes(bytearray('TCAG'.find(chr(c).upper()) if chr(c) in 'TCAGtcag' else 0
+                              for c in range(256)))
+_twobit_dec = [bytes(bytearray(b'TCAG'[(b >> (6-2*j)) & 3] for b in range(256)))
+               for j in range(4)]
+
+# the reference of transvar, see init_refgenome
+refgenome = None
+seqcache = None
+
+# open genomes, their file handles are reopened in forked children
+_genomes = weakref.WeakSet()
+
+def _reopen_after_fork():
+    for genome in list(_genomes):
+        genome.reopen()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
+
+class BgzfReader():
+
+    """ random access to the uncompressed bytes of a BGZF (bgzip) file
+    Slicing the reader with uncompressed offsets, as in a mmap, returns
+    bytes. Blocks are located through the .gzi index written by bgzip -i
+    (or samtools faidx), or by scanning the block headers when it is
+    absent. Decompressed blocks are kept in an LRU cache of nblocks.
+    Reads are serialized by a lock so that threads can share a reader.
+    """
+
+    def __init__(self, fn, nblocks=256):
+
+        self.fn = fn
+        self.fh = open(fn, 'rb')
+        self.lock = threading.Lock()
+        self.nblocks = nblocks
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(fn+'.gzi'):
+            self.load_gzi(fn+'.gzi')
+        else:
+            self.scan()
+
+    def load_gzi(self, gzi_fn):
+
+        """ .gzi: number of entries, then (compressed, uncompressed) offsets
+        of each block but the first, as little-endian uint64 """
+        with open(gzi_fn, 'rb') as fh:
+            n = struct.unpack('<Q', fh.read(8))[0]
+            offs = array('Q', [0, 0])
+            offs.frombytes(fh.read(16*n))
+        if sys.byteorder == 'big':
+            offs.byteswap()
+        self.coffs = offs[0::2]
+        self.uoffs = offs[1::2]
+
+    def scan(self):
+
+        self.coffs = array('Q')
+        self.uoffs = array('Q')
+        coff = uoff = 0
+        while True:
+            self.fh.seek(coff)
+            header = self.fh.read(18)
+            if len(header) < 18:
+                break
+            bsize = self._bsize(header)
+            self.fh.seek(coff+bsize-3)
+            isize = struct.unpack('<I', self.fh.read(4))[0]
+            if isize == 0:      # EOF marker
+                break
+            self.coffs.append(coff)
+            self.uoffs.append(uoff)
+            coff += bsize+1
+            uoff += isize
+
+    def _bsize(self, header):
+
+        if header[:4] != b'\x1f\x8b\x08\x04' or header[12:14] != b'BC':
+            raise SequenceRetrievalError('invalid BGZF block in %s' % self.fn)
+        return struct.unpack('<H', header[16:18])[0]
+
+    def block(self, i):
+
+        """ decompressed block i """
+        if i in self.cache:
+            self.hits += 1
+            data = self.cache.pop(i)
+            self.cache[i] = data
+            return data
+
+        self.misses += 1
+        self.fh.seek(self.coffs[i])
+        header = self.fh.read(18)
+        cdata = self.fh.read(self._bsize(header)+1-18)
+        data = zlib.decompress(cdata[:-8], -15)
+        self.cache[i] = data
+        if len(self.cache) > self.nblocks:
+            self.cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, sl):
+
+        start, stop = sl.start, sl.stop
+        i = bisect_right(self.uoffs, start)-1
+        segs = []
+        with self.lock:
+            while i < len(self.uoffs) and self.uoffs[i] < stop:
+                data = self.block(i)
+                segs.append(data[max(start-self.uoffs[i], 0):stop-self.uoffs[i]])
+                i += 1
+        return b''.join(segs)
+
+    def reopen(self):
+
+        """ new file handle (e.g., after fork, the offset of an inherited
+        handle is shared with the parent), block index and cache are kept """
+        self.fh.close()
+        self.fh = open(self.fn, 'rb')
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.fh.close()
+
+def check_window(faidx, chrom, start, end):
+
+    """ resolve chrom in faidx (name -> (length, ...)) and check the window
+    start and end are 1-based, return chrom, 0-based start and end """
+    if chrom not in faidx:
+        if chrom.startswith('chr') and chrom[3:] in faidx:
+            chrom = chrom[3:]
+        elif 'chr'+chrom in faidx:
+            chrom = 'chr'+chrom
+        else:
+            # sys.stderr.write('Chromosome %s not found in reference\n' % chrom)
+            raise SequenceRetrievalError('chromosome %s not found in reference' % chrom)
+
+    slen = faidx[chrom][0]
+    start = start-1 #To 0-base
+    # Sanity check of start and end position
+    if start<0:
+        raise SequenceRetrievalError('Sequence window out of bound--Chr: %s;Start:%d;End:%s' % (chrom,start+1,end))
+    elif end>slen and start-(end-slen)>=0: #end is out of bound, adjust the window towards start
+        end=slen
+        start=start-(end-slen)
+    elif end>slen:
+        raise SequenceRetrievalError('Sequence window out of bound--Chr: %s;Start:%d;End:%s' % (chrom,start+1,end))
+
+    if start>=end:
+        raise SequenceRetrievalError('Start position %d is larger than end position %d' % (start+1,end))
+
+    return chrom, start, end
+
 class RefGenome:
 
+    """ indexed (samtools faidx) reference fasta, may be bgzipped
+    The .fai is parsed once. The fasta is mapped read-only, so a genome
+    can be shared by threads and by forked processes, which keep the
+    mapping of the parent; only the file handle of a bgzipped fasta is
+    reopened in the child. Use as a context manager or call close().
+    """
+
     def __init__(self, fasta_file):
         self.faidx = {}
 
         self.fasta_file=fasta_file
+        self.fasta_fd = None
+        self.fasta_handle = None
 
         try:
-            self.fasta_fd = open(fasta_file)
-            self.fasta_handle = mmap.mmap(self.fasta_fd.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(fasta_file+".fai") as self.faidx_handle:
+                self.load_faidx()
         except IOError:
-            print("Reference sequence doesn't exist")
+            print("samtools faidx file doesn't exist for reference")
+
+        self.open()
+
+    def open(self):
 
         try:
-            self.faidx_handle=open(fasta_file+".fai")
+            if self.fasta_file.endswith('.gz'):
+                # bgzipped fasta, the .fai is in uncompressed offsets
+                self.fasta_handle = BgzfReader(self.fasta_file)
+                self.fasta_fd = self.fasta_handle.fh
+            else:
+                self.fasta_fd = open(self.fasta_file)
+                self.fasta_handle = mmap.mmap(self.fasta_fd.fileno(), 0, access=mmap.ACCESS_READ)
         except IOError:
-            print("samtools faidx file doesn't exist for reference")
-        self.load_faidx()
+            print("Reference sequence doesn't exist")
+        _genomes.add(self)
+
+    def reopen(self):
+
+        """ after fork, reads of a bgzipped fasta go through a file offset
+        shared with the parent, a mapping is read-only and kept """
+        if isinstance(self.fasta_handle, BgzfReader):
+            self.fasta_handle.reopen()
+            self.fasta_fd = self.fasta_handle.fh
+
+    def close(self):
+
+        if self.fasta_handle is not None:
+            self.fasta_handle.close()
+            self.fasta_fd.close()
+            self.fasta_handle = None
+            self.fasta_fd = None
+        _genomes.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __getstate__(self):
+
+        """ pickled (e.g., for spawned workers) with the parsed .fai """
+        return {'fasta_file': self.fasta_file, 'faidx': self.faidx}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
 
     # Function to cache fasta index in dictionary
     # faidx format contains the following columns:
@@ -42,66 +260,326 @@ class RefGenome:
             slen,offset,blen,bytelen=[int(i) for i in cols[1:]]
             self.faidx[chrom]=(slen,offset,blen,bytelen)
 
-    # Function to fetch sequence from an indexed fasta
+    # Function to locate sequence in an indexed fasta
     # *chrom--Chromosome name (str)
     # *start--Start position (1-based) (int)
     # *end--End position (1-based) (int)
-    # *keepN--Keep ambiguous bases in sequence (boolean)
-    def fetch_sequence(self, chrom, start, end):
+    # return the byte range [first, last) in the fasta file
+    def locate(self, chrom, start, end):
 
-        # Fetch a sequence from start to end in 1-based coordinates
-        seq=""
+        chrom, start, end = check_window(self.faidx, chrom, start, end)
+        slen,offset,blen,bytelen=self.faidx[chrom]
 
-        if chrom not in self.faidx:
-            if chrom.startswith('chr') and chrom[3:] in self.faidx:
-                chrom = chrom[3:]
-            elif 'chr'+chrom in self.faidx:
-                chrom = 'chr'+chrom
-            else:
-                # sys.stderr.write('Chromosome %s not found in reference\n' % chrom)
-                raise SequenceRetrievalError('chromosome %s not found in reference' % chrom)
+        # bytes of the first and the last base, newlines in between
+        first = offset+start//blen*bytelen+start%blen
+        last = offset+(end-1)//blen*bytelen+(end-1)%blen
+        return first, last+1
 
-        slen,offset,blen,bytelen=self.faidx[chrom]
-        start = start-1 #To 0-base
-        # Sanity check of start and end position
-        if start<0:
-            raise SequenceRetrievalError('Sequence window out of bound--Chr: %s;Start:%d;End:%s' % (chrom,start+1,end))
-        elif end>slen and start-(end-slen)>=0: #end is out of bound, adjust the window towards start
-            end=slen
-            start=start-(end-slen)
-        elif end>slen:
-            raise SequenceRetrievalError('Sequence window out of bound--Chr: %s;Start:%d;End:%s' % (chrom,start+1,end))
+    def fetch_view(self, chrom, start, end):
+
+        """ zero-copy view of the fasta bytes from start to end (1-based),
+        as in the file, i.e., with line breaks and the original case
+        (a view of a copy for bgzipped fasta) """
+        first, last = self.locate(chrom, start, end)
+        if isinstance(self.fasta_handle, BgzfReader):
+            return memoryview(self.fasta_handle[first:last])
+        return memoryview(self.fasta_handle)[first:last]
 
-        if start>=end:
-            raise SequenceRetrievalError('Start position %d is larger than end position %d' % (start+1,end))
+    def fetch_bytes(self, chrom, start, end):
 
-        self.fasta_handle.seek(offset+start//blen*bytelen+start%blen)
+        """ sequence from start to end (1-based) as upper-case bytes """
+        first, last = self.locate(chrom, start, end)
+        return self.fasta_handle[first:last].translate(_upper, b'\r\n')
 
-        while len(seq)<end-start:
-            line=self.fasta_handle.readline().decode()
-            line=line[:-1] #Remove newline symbols
-            seq=seq+line
+    def fetch_sequence(self, chrom, start, end):
 
-        #chomp off extra bases
-        return seq[:end-start].upper()
+        """ sequence from start to end (1-based) as upper-case str """
+        return self.fetch_bytes(chrom, start, end).decode('ascii')
 
-    def __exit__(self, type, value, traceback):
-        self.fasta_handle.close()
-        self.fasta_fd.close()
-        self.faidx_handle.close()
+    def fetch_ranges(self, chrom, ranges):
+
+        """ sequences of the (start, end) ranges (1-based) on chrom as
+        upper-case str, each range is read on its own """
+        return [self.fetch_bytes(chrom, start, end).decode('ascii')
+                for start, end in ranges]
 
     def chrm2len(self, chrm):
         slen,offset,blen,bytelen=self.faidx[chrm]
         return slen
 
+class TwoBitGenome:
+
+    """ reference genome in UCSC 2-bit format, see write_twobit
+    Bases are packed 4 per byte (T, C, A, G as 0-3) and runs of other
+    bases are kept in a per-sequence N-block table, so that the genome
+    takes about a quarter of the FASTA in page cache. Provides the
+    RefGenome interface, including its lifecycle; the soft-mask blocks
+    are not read since sequences are returned upper-case.
+    """
+
+    def __init__(self, twobit_file):
+
+        self.faidx = {}         # chrom -> (length, offset of packed bases)
+        self.nblocks = {}       # chrom -> (starts, sizes) of N runs
+        self.fasta_file = twobit_file
+        self.open()
+        self.load_index()
+
+    def open(self):
+
+        self.fasta_fd = open(self.fasta_file, 'rb')
+        self.fasta_handle = mmap.mmap(self.fasta_fd.fileno(), 0, access=mmap.ACCESS_READ)
+        _genomes.add(self)
+
+    def reopen(self):
+
+        """ the mapping is read-only, forked processes keep the parent's """
+        pass
+
+    def close(self):
+
+        if self.fasta_handle is not None:
+            self.fasta_handle.close()
+            self.fasta_fd.close()
+            self.fasta_handle = None
+            self.fasta_fd = None
+        _genomes.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        return {'fasta_file': self.fasta_file, 'faidx': self.faidx, 'nblocks': self.nblocks}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.open()
+
+    def load_index(self):
+
+        mm = self.fasta_handle
+        if struct.unpack('<I', mm[:4])[0] == _twobit_sig:
+            e = '<'
+        elif struct.unpack('>I', mm[:4])[0] == _twobit_sig:
+            e = '>'
+        else:
+            raise SequenceRetrievalError('invalid 2bit file %s' % self.fasta_file)
+
+        def _ints(o, n):
+            return array('I', struct.unpack(e+'%dI' % n, mm[o:o+4*n]))
+
+        version, nseq, _ = struct.unpack(e+'3I', mm[4:16])
+        o = 16
+        for i in range(nseq):
+            namelen = mm[o]
+            name = mm[o+1:o+1+namelen].decode()
+            recoff = struct.unpack(e+'I', mm[o+1+namelen:o+5+namelen])[0]
+            o += 5+namelen
+
+            slen, nn = struct.unpack(e+'2I', mm[recoff:recoff+8])
+            nstarts = _ints(recoff+8, nn)
+            nsizes = _ints(recoff+8+4*nn, nn)
+            moff = recoff+8+8*nn
+            nm = struct.unpack(e+'I', mm[moff:moff+4])[0]
+            dnaoff = moff+4+8*nm+4
+
+            chrom = normalize_chrm(name)
+            self.faidx[chrom] = (slen, dnaoff)
+            self.nblocks[chrom] = (nstarts, nsizes)
+
+    def fetch_bytes(self, chrom, start, end):
+
+        """ sequence from start to end (1-based) as upper-case bytes """
+        chrom, start, end = check_window(self.faidx, chrom, start, end)
+        slen, dnaoff = self.faidx[chrom]
+
+        packed = self.fasta_handle[dnaoff+start//4:dnaoff+(end-1)//4+1]
+        seq = bytearray(4*len(packed))
+        for j in range(4):
+            seq[j::4] = packed.translate(_twobit_dec[j])
+        seq = seq[start%4:start%4+end-start]
+
+        nstarts, nsizes = self.nblocks[chrom]
+        k = max(bisect_right(nstarts, start)-1, 0)
+        while k < len(nstarts) and nstarts[k] < end:
+            nbeg = max(nstarts[k], start)
+            nend = min(nstarts[k]+nsizes[k], end)
+            if nbeg < nend:
+                seq[nbeg-start:nend-start] = b'N'*(nend-nbeg)
+            k += 1
+
+        return bytes(seq)
+
+    def fetch_view(self, chrom, start, end):
+
+        """ memoryview of fetch_bytes, packed bases cannot be viewed in place """
+        return memoryview(self.fetch_bytes(chrom, start, end))
+
+    def fetch_sequence(self, chrom, start, end):
+
+        """ sequence from start to end (1-based) as upper-case str """
+        return self.fetch_bytes(chrom, start, end).decode('ascii')
+
+    def fetch_ranges(self, chrom, ranges):
+
+        """ sequences of the (start, end) ranges (1-based) on chrom as
+        upper-case str, each range is read on its own """
+        return [self.fetch_bytes(chrom, start, end).decode('ascii')
+                for start, end in ranges]
+
+    def chrm2len(self, chrm):
+        return self.faidx[chrm][0]
+
+def _twobit_pack(seq):
+
+    """ pack bases, 4 per byte, the first base in the highest bits """
+    codes = seq.translate(_twobit_enc)
+    codes += b'\0' * (-len(codes) % 4)
+    n = len(codes) // 4
+    packed = 0
+    for j in range(4):
+        # codes are at most 3 so that shifted bytes never carry over
+        packed |= int.from_bytes(codes[j::4], 'big') << (6-2*j)
+    return packed.to_bytes(n, 'big')
+
+def _twobit_record(seq):
+
+    nblocks = [(m.start(), m.end()-m.start()) for m in re.finditer(b'[^ACGTacgt]+', seq)]
+    mblocks = [(m.start(), m.end()-m.start()) for m in re.finditer(b'[a-z]+', seq)]
+    rec = [struct.pack('<2I', len(seq), len(nblocks))]
+    rec.append(struct.pack('<%dI' % len(nblocks), *[b for b, l in nblocks]))
+    rec.append(struct.pack('<%dI' % len(nblocks), *[l for b, l in nblocks]))
+    rec.append(struct.pack('<I', len(mblocks)))
+    rec.append(struct.pack('<%dI' % len(mblocks), *[b for b, l in mblocks]))
+    rec.append(struct.pack('<%dI' % len(mblocks), *[l for b, l in mblocks]))
+    rec.append(struct.pack('<I', 0))
+    rec.append(_twobit_pack(seq))
+    return b''.join(rec)
+
+def write_twobit(fasta_file, twobit_file):
+
+    """ write the indexed fasta_file (may be bgzipped) in UCSC 2-bit format
+    sequences are read through RefGenome and converted one at a time, the
+    index at the head of the file is filled in at the end """
+    # the sequence names as in the fasta, RefGenome normalizes them
+    entries = []
+    with open(fasta_file+'.fai') as fh:
+        for line in fh:
+            cols = line.rstrip('\n').split('\t')
+            entries.append((cols[0].encode('utf-8'), [int(_) for _ in cols[1:5]]))
+    names = [name for name, fai in entries]
+
+    with RefGenome(fasta_file) as genome, open(twobit_file, 'wb') as out:
+        out.write(struct.pack('<4I', _twobit_sig, 0, len(names), 0))
+        idx_off = out.tell()
+        out.write(b''.join([struct.pack('<B', len(name))+name+b'\0\0\0\0' for name in names]))
+
+        offsets = []
+        for name, (slen, offset, blen, bytelen) in entries:
+            last = offset+(slen-1)//blen*bytelen+(slen-1)%blen if slen else offset-1
+            offsets.append(out.tell())
+            out.write(_twobit_record(genome.fasta_handle[offset:last+1].translate(None, b'\r\n')))
+
+        out.seek(idx_off)
+        out.write(b''.join([struct.pack('<B', len(name))+name+struct.pack('<I', o)
+                            for name, o in zip(names, offsets)]))
+
+class SeqCache():
+
+    """ cache of the reference in aligned blocks of blocksize bases
+    Short fetches, e.g., reference checks and flanking sequences, are
+    served from the blocks, the nblocks least recently used are kept.
+    Coordinate-sorted inputs read each block from the reference once.
+    The cache can be shared by threads.
+    """
+
+    def __init__(self, genome, blocksize=1<<16, nblocks=256):
+
+        self.genome = genome
+        self.lock = threading.Lock()
+        self.blocksize = blocksize
+        self.nblocks = nblocks
+        self.blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def block(self, chrom, k):
+
+        key = (chrom, k)
+        with self.lock:
+            if key in self.blocks:
+                self.hits += 1
+                seq = self.blocks.pop(key)
+                self.blocks[key] = seq
+                return seq
+            self.misses += 1
+
+        slen = self.genome.faidx[chrom][0]
+        seq = self.genome.fetch_sequence(
+            chrom, k*self.blocksize+1, min((k+1)*self.blocksize, slen))
+        with self.lock:
+            self.blocks[key] = seq
+            if len(self.blocks) > self.nblocks:
+                self.blocks.popitem(last=False)
+                self.evictions += 1
+        return seq
+
+    def fetch_sequence(self, chrom, start, end):
+
+        """ same as fetch_sequence of the genome """
+        chrom, start, end = check_window(self.genome.faidx, chrom, start, end)
+        bs = self.blocksize
+        kbeg = start // bs
+        kend = (end-1) // bs
+        if kbeg == kend:
+            return self.block(chrom, kbeg)[start-kbeg*bs:end-kbeg*bs]
+
+        segs = [self.block(chrom, k) for k in range(kbeg, kend+1)]
+        segs[-1] = segs[-1][:end-kend*bs]
+        segs[0] = segs[0][start-kbeg*bs:]
+        return ''.join(segs)
+
+    def stats(self):
+        return 'reference cache: %d hits, %d misses, %d evictions, %d blocks of %d bp' % (
+            self.hits, self.misses, self.evictions, len(self.blocks), self.blocksize)
+
+def open_refgenome(r):
+
+    """ RefGenome or TwoBitGenome by the file name """
+    if r.endswith('.2bit'):
+        return TwoBitGenome(r)
+    return RefGenome(r)
+
 def init_refgenome(r=None):
-    global refgenome
-    refgenome = RefGenome(r) if r else None
+
+    """ set the module reference to r, an already open reference of
+    the same file (e.g., inherited by a forked worker) is kept """
+    global refgenome, seqcache
+    if r and refgenome is not None and refgenome.fasta_file == r:
+        return refgenome
+
+    close_refgenome()
+    refgenome = open_refgenome(r) if r else None
+    seqcache = SeqCache(refgenome) if refgenome else None
+    return refgenome
+
+def close_refgenome():
+
+    global refgenome, seqcache
+    if refgenome is not None:
+        refgenome.close()
+    refgenome = None
+    seqcache = None
 
 def getseq(chrm, beg, end):
 
-    global refgenome
-    return refgenome.fetch_sequence(chrm, beg, end)
+    """ short reference sequence, through the block cache """
+    global seqcache
+    return seqcache.fetch_sequence(chrm, beg, end)
 
 def reflen(chrm):
     try:
@@ -122,7 +600,7 @@ class SeqBuf():
         self.beg = p - 1000
         self.end = p + 1000
         global refgenome
-        self.seq = refgenome.fetch_sequence(self.chrm, self.beg, self.end)
+        self.seq = getseq(self.chrm, self.beg, self.end)
         if len(self.seq) != 2001:
             raise WrongReferenceError("Invalid_position_%d_(expect_from_0_to_%d_at_%s)" % (p, refgenome.chrm2len(self.chrm), self.chrm))
 
@@ -33,14 +33,796 @@ import re, os
 from .utils import *
 from .transcripts import *
 from pickle import load, dump
-from . import faidx
 from . import tabix
+from . import faidx
+from .output import BgzfWriter
 import subprocess
+import struct
+import mmap
+import hashlib
+import gzip
+import heapq
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
 
 tabix_path = '%s/tabix' % os.path.abspath(os.path.dirname(__file__))
 bgzip_path = '%s/bgzip' % os.path.abspath(os.path.dirname(__file__))
 
 p_trxn_version=re.compile(r'(.*)\.(\d+)$')
+p_gtf_attr_ensembl=re.compile(r'\s*([^"]*) "([^"]*)";')
+p_gtf_attr_gencode=re.compile(r'\s*([^";]*) "([^"]*)";')
+
+# per raw format, the attribute parser, the features and the attributes used
+raw_formats = {
+    'ensembl': (p_gtf_attr_ensembl.findall,
+                ['gene', 'transcript', 'exon', 'CDS'],
+                ['gene_id', 'gene_name', 'gene_biotype', 'transcript_id',
+                 'transcript_biotype', 'protein_id']),
+    'gencode': (p_gtf_attr_gencode.findall,
+                ['gene', 'transcript', 'exon', 'CDS'],
+                ['gene_id', 'gene_name', 'gene_type', 'transcript_id',
+                 'transcript_type', 'protein_id']),
+    'refseq': (lambda s: [_.split('=') for _ in s.split(';')],
+               ['region', 'gene', 'mRNA', 'ncRNA', 'rRNA', 'tRNA', 'exon', 'CDS'],
+               ['chromosome', 'map', 'pseudo', 'Name', 'ID', 'Dbxref', 'Parent',
+                'ncrna_class', 'product', 'protein_id']),
+}
+
+def parse_raw_chunk(raw_format, lines, compact=False):
+
+    """ parse GTF/GFF lines into (fields, info) of the features used
+    compact records, to be sent from the worker processes, leave out the
+    attribute column from fields and the attributes not used from info """
+    parse_attrs, features, attrs = raw_formats[raw_format]
+    recs = []
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        fields = line.strip('\n').split('\t')
+        if raw_format == 'refseq' and len(fields) < 9:
+            continue
+        if fields[2] not in features:
+            continue
+        info = dict(parse_attrs(fields[8]))
+        if compact:
+            del fields[8:]
+            info = {a: info[a] for a in attrs if a in info}
+        recs.append((fields, info))
+    return recs
+
+class TrnxBin():
+
+    """ binary transcript store (*.transvardb.trxn_bin)
+    The file starts with a header (magic, format version, number of records),
+    followed by two int64 arrays: the offsets of the records in the text
+    .transvardb (ascending) and the offsets of the same records in this file.
+    Each record is a fixed-width header (coordinates, strand and string lengths)
+    followed by the utf-8 strings and the exons packed as int32 pairs.
+    The offsets in .gene_idx, .trxn_idx and .alias_idx therefore stay valid.
+    """
+
+    magic = b'TVB1'
+    header = struct.Struct('<4sIQ')
+    rec_header = struct.Struct('<iiiiiIcHHHHHH')
+
+    def __init__(self, fn):
+
+        self.fn = fn
+        self.fh = open(fn, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt_version, n = self.header.unpack_from(self.mm, 0)
+        if magic != self.magic:
+            raise Exception('%s is not a TransVar binary transcript file' % fn)
+        o = self.header.size
+        self.txtposes = array('q')
+        self.txtposes.frombytes(self.mm[o:o+8*n])
+        o += 8*n
+        self.binposes = array('q')
+        self.binposes.frombytes(self.mm[o:o+8*n])
+        if sys.byteorder == 'big':
+            self.txtposes.byteswap()
+            self.binposes.byteswap()
+
+    def __len__(self):
+        return len(self.txtposes)
+
+    def index(self, txtpos):
+        """ record index from the offset in the text .transvardb """
+        i = bisect_left(self.txtposes, txtpos)
+        if i < len(self.txtposes) and self.txtposes[i] == txtpos:
+            return i
+        return None
+
+    def decode(self, i, source=''):
+
+        """ decode the i-th record into a Transcript """
+        mm = self.mm
+        o = self.binposes[i]
+        (beg, end, cds_beg, cds_end, version, nexons, strand,
+         l_gene, l_name, l_type, l_chrm, l_alias, l_dbxref) = self.rec_header.unpack_from(mm, o)
+        o += self.rec_header.size
+        strs = []
+        for l in (l_gene, l_name, l_type, l_chrm, l_alias, l_dbxref):
+            strs.append(mm[o:o+l].decode('utf-8'))
+            o += l
+        gene_name, name, transcript_type, chrm, aliases, dbxref = strs
+        ex = struct.unpack_from('<%di' % (2*nexons), mm, o)
+
+        t = Transcript(transcript_type=transcript_type)
+        t.gene_name = gene_name
+        t.name = name
+        t.version = version
+        t.beg = beg
+        t.end = end
+        t.chrm = chrm
+        t.strand = strand.decode('ascii').strip('\0')
+        t.cds_beg = cds_beg
+        t.cds_end = cds_end
+        t.exons = list(zip(ex[0::2], ex[1::2]))
+        if aliases:
+            t.aliases = aliases.split(';')
+        t.gene_dbxref = dbxref
+        t.source = source
+        return t
+
+    def locus(self, i):
+
+        """ chromosome, begin, end and name of the i-th record,
+        without decoding the rest of the record """
+        mm = self.mm
+        o = self.binposes[i]
+        h = self.rec_header.unpack_from(mm, o)
+        beg, end = h[0], h[1]
+        l_gene, l_name, l_type, l_chrm = h[7:11]
+        o += self.rec_header.size + l_gene
+        name = mm[o:o+l_name].decode('utf-8')
+        o += l_name + l_type
+        chrm = mm[o:o+l_chrm].decode('utf-8')
+        return chrm, beg, end, name
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+    @classmethod
+    def write(cls, fn, records):
+
+        """ records are (text offset, transcript, gene dbxref), in text offset order """
+        n = len(records)
+        txtposes = array('q', [pos for pos, t, dbxref in records])
+        binposes = array('q')
+        body = []
+        o = cls.header.size + 16*n
+        for pos, t, dbxref in records:
+            strs = [_.encode('utf-8') for _ in (
+                t.gene_name, t.name, t.transcript_type, t.chrm,
+                ';'.join(t.aliases), dbxref)]
+            ex = [x for exon in t.exons for x in exon]
+            rec = (cls.rec_header.pack(
+                t.beg, t.end, t.cds_beg, t.cds_end, t.version, len(t.exons),
+                t.strand.encode('ascii') or b'\0', *[len(_) for _ in strs]) +
+                   b''.join(strs) + struct.pack('<%di' % len(ex), *ex))
+            binposes.append(o)
+            body.append(rec)
+            o += len(rec)
+
+        if sys.byteorder == 'big':
+            txtposes.byteswap()
+            binposes.byteswap()
+        with open(fn, 'wb') as fh:
+            fh.write(cls.header.pack(cls.magic, 1, n))
+            fh.write(txtposes.tobytes())
+            fh.write(binposes.tobytes())
+            fh.write(b''.join(body))
+
+class TrnxSeq():
+
+    """ spliced CDS and protein sequences (*.transvardb.trxn_seq), optionally
+    written by transvar index --store-seq together with the reference.
+    The file starts with a header (magic, format version, number of records,
+    digest and path of the reference, see reference_digest, and the sample of
+    records checked against the reference, see matches), followed by
+    four int64 arrays: the offsets of the transcripts in the text
+    .transvardb (ascending), the offsets of their sequences in this file, the
+    CDS lengths and the protein lengths. Each sequence is the CDS (in the
+    natural sense, as Transcript.seq) immediately followed by the protein
+    (as Transcript.get_proteinseq). A length of -1 marks a CDS that could not
+    be retrieved or a protein that could not be translated, these are left to
+    the reference at query time.
+    """
+
+    magic = b'TVS1'
+    header = struct.Struct('<4sIQ')
+    ref_header = struct.Struct('<16sH')
+    # records per chromosome checked against the reference when opened
+    nsample = 4
+
+    def __init__(self, fn):
+
+        self.fn = fn
+        self.fh = open(fn, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt_version, n = self.header.unpack_from(self.mm, 0)
+        if magic != self.magic:
+            raise Exception('%s is not a TransVar sequence file' % fn)
+        o = self.header.size
+        # the reference is not recorded before format version 3
+        self.ref_digest = self.ref_path = None
+        self.sample = array('I')
+        if fmt_version >= 3:
+            self.ref_digest, pathlen = self.ref_header.unpack_from(self.mm, o)
+            o += self.ref_header.size
+            self.ref_path = self.mm[o:o+pathlen].decode('utf-8')
+            o += pathlen
+            nsample = struct.unpack_from('<I', self.mm, o)[0]
+            o += 4
+            self.sample.frombytes(self.mm[o:o+4*nsample])
+            if sys.byteorder == 'big':
+                self.sample.byteswap()
+            o += 4*nsample
+        arrs = []
+        for k in range(4):
+            a = array('q')
+            a.frombytes(self.mm[o:o+8*n])
+            if sys.byteorder == 'big':
+                a.byteswap()
+            arrs.append(a)
+            o += 8*n
+        self.txtposes, self.seqposes, self.cdslens, self.protlens = arrs
+
+    @staticmethod
+    def reference_digest(genome):
+
+        """ md5 of the sequence names and lengths of the reference (as in
+        its .fai), the same for a fasta, its bgzipped and its 2-bit copy """
+        h = hashlib.md5()
+        for chrm in sorted(genome.faidx):
+            h.update(('%s\t%d\n' % (chrm, genome.faidx[chrm][0])).encode('utf-8'))
+        return h.digest()
+
+    def matches(self, trnx_bin):
+
+        """ whether the sequences were retrieved from faidx.refgenome: the
+        sequence names and lengths agree and the CDS of the sampled records,
+        fetched again through trnx_bin, are the ones stored """
+        if self.ref_digest != self.reference_digest(faidx.refgenome):
+            return False
+        for j in self.sample:
+            cds = self.cds(j)
+            if cds is None:
+                continue
+            i = trnx_bin.index(self.txtposes[j])
+            if i is None:
+                return False
+            t = trnx_bin.decode(i)
+            try:
+                t.ensure_seq()
+            except SequenceRetrievalError:
+                return False
+            if t.seq != cds:
+                return False
+        return True
+
+    def index(self, txtpos):
+        """ record index from the offset in the text .transvardb """
+        i = bisect_left(self.txtposes, txtpos)
+        if i < len(self.txtposes) and self.txtposes[i] == txtpos:
+            return i
+        return None
+
+    def cds(self, i):
+
+        """ CDS of the i-th record, None if not stored """
+        n = self.cdslens[i]
+        if n < 0:
+            return None
+        o = self.seqposes[i]
+        return self.mm[o:o+n].decode('ascii')
+
+    def protein(self, i):
+
+        """ protein of the i-th record, None if not stored """
+        n = self.protlens[i]
+        if n < 0 or self.cdslens[i] < 0:
+            return None
+        o = self.seqposes[i] + self.cdslens[i]
+        return self.mm[o:o+n].decode('ascii')
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
+
+    @classmethod
+    def write(cls, fn, records):
+
+        """ records are (text offset, transcript), in text offset order,
+        sequences are retrieved from faidx.refgenome """
+        n = len(records)
+        txtposes = array('q', [pos for pos, t in records])
+        seqposes = array('q')
+        cdslens = array('q')
+        protlens = array('q')
+        ref_path = os.path.abspath(faidx.refgenome.fasta_file).encode('utf-8')
+        # records spread evenly within each chromosome
+        chrm2recs = {}
+        for k, (pos, t) in enumerate(records):
+            chrm2recs.setdefault(t.chrm, []).append(k)
+        sample = array('I')
+        for chrm in sorted(chrm2recs):
+            ks = chrm2recs[chrm]
+            m = min(cls.nsample, len(ks))
+            sample.extend(ks[(2*x+1)*len(ks)//(2*m)] for x in range(m))
+        if sys.byteorder == 'big':
+            sample.byteswap()
+        ref_header = (cls.ref_header.pack(cls.reference_digest(faidx.refgenome), len(ref_path)) +
+                      ref_path + struct.pack('<I', len(sample)) + sample.tobytes())
+        with open(fn, 'wb') as fh:
+            o = cls.header.size + len(ref_header) + 32*n
+            fh.seek(o)
+            for pos, t in records:
+                try:
+                    t.ensure_seq()
+                    cds = t.seq
+                except SequenceRetrievalError:
+                    cds = None
+                try:
+                    prot = translate_seq(cds) if cds is not None else None
+                except IncompatibleTranscriptError:
+                    prot = None
+                t.seq = None
+
+                seqposes.append(o)
+                cdslens.append(-1 if cds is None else len(cds))
+                protlens.append(-1 if prot is None else len(prot))
+                seq = (cds or '') + (prot or '')
+                fh.write(seq.encode('ascii'))
+                o += len(seq)
+
+            arrs = [txtposes, seqposes, cdslens, protlens]
+            if sys.byteorder == 'big':
+                for a in arrs:
+                    a.byteswap()
+            fh.seek(0)
+            fh.write(cls.header.pack(cls.magic, 3, n))
+            fh.write(ref_header)
+            for a in arrs:
+                fh.write(a.tobytes())
+
+def _write_chrm_table(fh, chrms):
+
+    """ chromosome table of the binary stores, (name, first, last) """
+    for c, first, last in chrms:
+        name = c.encode('utf-8')
+        fh.write(struct.pack('<B', len(name)) + name + struct.pack('<QQ', first, last))
+    fh.write(b'\0' * (-fh.tell() % 8))
+
+def _read_chrm_table(mm, o, nchrom):
+
+    chrms = {}
+    for k in range(nchrom):
+        l = mm[o]
+        name = mm[o+1:o+1+l].decode('utf-8')
+        chrms[name] = struct.unpack_from('<QQ', mm, o+1+l)
+        o += 1+l+16
+    return chrms, o + (-o % 8)
+
+def _write_column(fh, a, pad=True):
+
+    """ little-endian column, padded to 8 bytes unless more is to come """
+    if sys.byteorder == 'big':
+        a = array(a.typecode, a)
+        a.byteswap()
+    fh.write(a.tobytes())
+    if pad:
+        fh.write(b'\0' * (-fh.tell() % 8))
+
+def _map_column(mm, o, typecode, n):
+
+    """ column of n items at o of the mapped file, and the offset past it """
+    size = array(typecode).itemsize * n
+    if sys.byteorder == 'little':
+        a = memoryview(mm)[o:o+size].cast(typecode)
+    else:
+        a = array(typecode, mm[o:o+size])
+        a.byteswap()
+    return a, o + size + (-size % 8)
+
+def _release_columns(*cols):
+    for a in cols:
+        if isinstance(a, memoryview):
+            a.release()
+
+class DbsnpBin():
+
+    """ binary dbSNP store (<dbsnp vcf>.snp_bin), written by transvar index --dbsnp
+    The file starts with a header (magic, format version, number of records,
+    number of chromosomes, size and mtime of the dbSNP VCF so that an updated
+    VCF is noticed), followed by the chromosome table (name, index of
+    the first and past the last record), the positions of all the records as
+    uint32 (sorted within each chromosome), the offsets of the records in the
+    text heap as uint64 and the heap, one 'ID\tREF\tALT' per record. Lookups
+    bisect the positions in the mapped file and only decode the records hit.
+    """
+
+    magic = b'TVD1'
+    header = struct.Struct('<4sIQI')
+    src_header = struct.Struct('<Qq')
+
+    def __init__(self, fn):
+
+        self.fn = fn
+        self.fh = open(fn, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt_version, n, nchrom = self.header.unpack_from(self.mm, 0)
+        if magic != self.magic:
+            raise Exception('%s is not a TransVar dbSNP file' % fn)
+        o = self.header.size
+        # the VCF is not recorded in format version 1
+        self.src_size = self.src_mtime = None
+        if fmt_version >= 2:
+            self.src_size, self.src_mtime = self.src_header.unpack_from(self.mm, o)
+            o += self.src_header.size
+        self.chrms, o = _read_chrm_table(self.mm, o, nchrom)
+        self.poses, o = _map_column(self.mm, o, 'I', n)
+        self.heapoffs, o = _map_column(self.mm, o, 'Q', n+1)
+        self.heap = o
+
+    def is_current(self, vcf_fn):
+
+        """ whether the store was converted from vcf_fn as it is on disk now """
+        if not os.path.exists(vcf_fn):
+            return False
+        st = os.stat(vcf_fn)
+        return (st.st_size, st.st_mtime_ns) == (self.src_size, self.src_mtime)
+
+    def at(self, chrm, pos):
+
+        """ the records at pos as VCF fields (CHROM, POS, ID, REF, ALT), in file order """
+        if chrm not in self.chrms:
+            return []
+        first, last = self.chrms[chrm]
+        i = bisect_left(self.poses, pos, first, last)
+        recs = []
+        while i < last and self.poses[i] == pos:
+            rec = self.mm[self.heap+self.heapoffs[i]:self.heap+self.heapoffs[i+1]]
+            recs.append([chrm, str(pos)] + rec.decode('utf-8').split('\t'))
+            i += 1
+        return recs
+
+    def close(self):
+        _release_columns(self.poses, self.heapoffs)
+        self.mm.close()
+        self.fh.close()
+
+    @classmethod
+    def write(cls, vcf_fn, fn, batch=1<<20):
+
+        """ convert the (sorted, as for tabix) dbSNP VCF
+        the positions, the heap offsets and the heap are streamed to
+        temporary files, batch records at a time, and put together at the end """
+        st = os.stat(vcf_fn)
+        chrms = []
+        n = 0
+        poses = array('I')
+        heapoffs = array('Q', [0])
+        pos_fn, off_fn, heap_fn = fn+'.pos', fn+'.off', fn+'.heap'
+        with open(pos_fn, 'wb') as pos_fh, open(off_fn, 'wb') as off_fh, open(heap_fn, 'wb') as heap:
+            chrm = None
+            seen = set()
+            last_pos = heapoff = 0
+            for line in opengz(vcf_fn):
+                if line.startswith('#'):
+                    continue
+                fields = line.split('\t', 5)
+                pos = int(fields[1])
+                if fields[0] != chrm:
+                    if fields[0] in seen:
+                        err_die('%s is not sorted, records of %s are not together' % (vcf_fn, fields[0]))
+                    chrm = fields[0]
+                    seen.add(chrm)
+                    chrms.append((chrm, n))
+                elif pos < last_pos:
+                    err_die('%s is not sorted at %s:%d' % (vcf_fn, chrm, pos))
+                rec = ('%s\t%s\t%s' % (fields[2], fields[3], fields[4].rstrip('\n'))).encode('utf-8')
+                heap.write(rec)
+                heapoff += len(rec)
+                poses.append(pos)
+                heapoffs.append(heapoff)
+                last_pos = pos
+                n += 1
+                if len(poses) >= batch:
+                    _write_column(pos_fh, poses, False)
+                    _write_column(off_fh, heapoffs, False)
+                    del poses[:]
+                    del heapoffs[:]
+            _write_column(pos_fh, poses, False)
+            _write_column(off_fh, heapoffs, False)
+
+        ends = [first for c, first in chrms[1:]] + [n]
+        with open(fn, 'wb') as fh:
+            fh.write(cls.header.pack(cls.magic, 2, n, len(chrms)))
+            fh.write(cls.src_header.pack(st.st_size, st.st_mtime_ns))
+            _write_chrm_table(fh, [(c, first, last) for (c, first), last in zip(chrms, ends)])
+            for col_fn in [pos_fn, off_fn, heap_fn]:
+                with open(col_fn, 'rb') as col:
+                    shutil.copyfileobj(col, fh, 1<<24)
+                os.remove(col_fn)
+                fh.write(b'\0' * (-fh.tell() % 8))
+
+class FeatureBin():
+
+    """ all the FeatureDB tracks of a reference version merged into one
+    binary store, written by transvar index --merge-features and rebuilt
+    when a track is re-indexed
+
+    After the header (magic, format version, number of features, number
+    of chromosomes, number of tracks) come the tracks (name, path of the
+    .featuredb, its size and mtime so that a re-indexed track is noticed),
+    the chromosome table and, per feature, the 0-based begin, the end, the
+    running maximum of the ends within the chromosome, the track and the
+    offset of the 'BEG\tEND\tANNOTATION' text in the heap. Features are
+    ordered by begin, then by track, then as in the track.
+    """
+
+    magic = b'TVF1'
+    header = struct.Struct('<4sIQII')
+
+    def __init__(self, fn):
+
+        self.fn = fn
+        self.fh = open(fn, 'rb')
+        self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt_version, n, nchrom, ntrack = self.header.unpack_from(self.mm, 0)
+        if magic != self.magic:
+            raise Exception('%s is not a TransVar feature file' % fn)
+        o = self.header.size
+        self.tracks = []
+        for k in range(ntrack):
+            l1, l2 = struct.unpack_from('<HH', self.mm, o)
+            o += 4
+            rname = self.mm[o:o+l1].decode('utf-8')
+            featdb = self.mm[o+l1:o+l1+l2].decode('utf-8')
+            o += l1+l2
+            size, mtime = struct.unpack_from('<Qq', self.mm, o)
+            o += 16
+            self.tracks.append((rname, featdb, size, mtime))
+        o += -o % 8
+        self.chrms, o = _read_chrm_table(self.mm, o, nchrom)
+        self.begs, o = _map_column(self.mm, o, 'I', n)
+        self.ends, o = _map_column(self.mm, o, 'I', n)
+        self.maxends, o = _map_column(self.mm, o, 'I', n)
+        self.trackids, o = _map_column(self.mm, o, 'H', n)
+        self.heapoffs, o = _map_column(self.mm, o, 'Q', n+1)
+        self.heap = o
+
+    def is_current(self, features):
+
+        """ whether the store is made of exactly the tracks in features,
+        [(rname, featdb)], as they are on disk now """
+        if [(rname, featdb) for rname, featdb, size, mtime in self.tracks] != features:
+            return False
+        for rname, featdb, size, mtime in self.tracks:
+            if not os.path.exists(featdb):
+                return False
+            st = os.stat(featdb)
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                return False
+        return True
+
+    def overlap(self, chrm, beg, end):
+
+        """ features overlapping beg to end (1-based, as for tabix_query),
+        as (rname, [CHROM, BEG, END, ANNOTATION]), by track and then in
+        track order """
+        if chrm not in self.chrms:
+            return []
+        q0 = max(0, beg-1)
+        if end <= q0:
+            return []
+        first, last = self.chrms[chrm]
+        hi = bisect_left(self.begs, end, first, last)
+        lo = bisect_right(self.maxends, q0, first, hi)
+        hits = []
+        for i in range(lo, hi):
+            if self.ends[i] > q0:
+                rec = self.mm[self.heap+self.heapoffs[i]:self.heap+self.heapoffs[i+1]]
+                hits.append((self.trackids[i], [chrm] + rec.decode('utf-8').split('\t')))
+        hits.sort(key=lambda h: h[0])
+        return [(self.tracks[t][0], fields) for t, fields in hits]
+
+    def close(self):
+        _release_columns(self.begs, self.ends, self.maxends, self.trackids, self.heapoffs)
+        self.mm.close()
+        self.fh.close()
+
+    @classmethod
+    def write(cls, features, fn):
+
+        """ merge the FeatureDB tracks, [(rname, featdb)] """
+        chrms = []              # in the order of first appearance
+        t2c2recs = []           # track => chrm => (begs, ends, heapoffs, reclens)
+        heap_fn = fn+'.heap'
+        with open(heap_fn, 'wb') as heap:
+            heapoff = 0
+            for rname, featdb in features:
+                c2recs = {}
+                chrm = None
+                for line in gzip.open(featdb, 'rt'):
+                    if line.startswith('#'):
+                        continue
+                    fields = line.rstrip('\n').split('\t', 1)
+                    if len(fields) < 2:
+                        continue
+                    if fields[0] != chrm:
+                        if fields[0] in c2recs:
+                            err_die('%s is not sorted, records of %s are not together' % (featdb, fields[0]))
+                        chrm = fields[0]
+                        tbegs, tends, theapoffs, treclens = c2recs[chrm] = (
+                            array('I'), array('I'), array('Q'), array('I'))
+                        if chrm not in chrms:
+                            chrms.append(chrm)
+                    cols = fields[1].split('\t', 2)
+                    beg = max(0, int(cols[0]))
+                    if tbegs and beg < tbegs[-1]:
+                        err_die('%s is not sorted at %s:%s' % (featdb, chrm, cols[0]))
+                    rec = fields[1].encode('utf-8')
+                    heap.write(rec)
+                    tbegs.append(beg)
+                    tends.append(max(0, int(cols[1])))
+                    theapoffs.append(heapoff)
+                    treclens.append(len(rec))
+                    heapoff += len(rec)
+                t2c2recs.append(c2recs)
+
+        begs = array('I')
+        ends = array('I')
+        maxends = array('I')
+        trackids = array('H')
+        heapoffs = array('Q', [0])
+        recoffs = array('Q')
+        ctable = []
+        for chrm in chrms:
+            first = len(begs)
+            tracks = []
+            for t, c2recs in enumerate(t2c2recs):
+                if chrm in c2recs:
+                    tbegs, tends, theapoffs, treclens = c2recs[chrm]
+                    tracks.append(zip(tbegs, [t]*len(tbegs), tends, theapoffs, treclens))
+            maxend = 0
+            for beg, t, end, recoff, reclen in heapq.merge(*tracks, key=lambda r: r[0]):
+                begs.append(beg)
+                ends.append(end)
+                maxend = max(maxend, end)
+                maxends.append(maxend)
+                trackids.append(t)
+                recoffs.append(recoff)
+                heapoffs.append(heapoffs[-1]+reclen)
+            ctable.append((chrm, first, len(begs)))
+
+        n = len(begs)
+        with open(fn, 'wb') as fh, open(heap_fn, 'rb') as heap_fh:
+            fh.write(cls.header.pack(cls.magic, 1, n, len(ctable), len(features)))
+            for rname, featdb in features:
+                rname_b = rname.encode('utf-8')
+                featdb_b = featdb.encode('utf-8')
+                st = os.stat(featdb)
+                fh.write(struct.pack('<HH', len(rname_b), len(featdb_b)) + rname_b + featdb_b)
+                fh.write(struct.pack('<Qq', st.st_size, st.st_mtime_ns))
+            fh.write(b'\0' * (-fh.tell() % 8))
+            _write_chrm_table(fh, ctable)
+            _write_column(fh, begs)
+            _write_column(fh, ends)
+            _write_column(fh, maxends)
+            _write_column(fh, trackids)
+            _write_column(fh, heapoffs)
+            # copy the records from the spooled heap in the merged order
+            if heapoffs[-1] > 0:
+                heap_mm = mmap.mmap(heap_fh.fileno(), 0, access=mmap.ACCESS_READ)
+                for i in range(n):
+                    fh.write(heap_mm[recoffs[i]:recoffs[i]+heapoffs[i+1]-heapoffs[i]])
+                heap_mm.close()
+        os.remove(heap_fn)
+
+class TrnxLocIndex():
+
+    """ in-memory interval index of transcript locations
+    For each chromosome, transcripts are kept in .loc_idx order (begin, end, name)
+    with the running maximum of the ends, so that the overlapping transcripts
+    are found by two bisections. A second ordering by end serves the closest
+    upstream transcript. Items are record indices in the TrnxBin or, when the
+    index is read from the .loc_idx, (begin, end, name) of the transcript.
+    The overlap follows the tabix query on .loc_idx: beg < query end
+    and end >= query begin, and nothing when query end < query begin.
+    """
+
+    def __init__(self, loci):
+
+        """ loci are (chrm, beg, end, name, item) """
+        chrm2recs = {}
+        for chrm, beg, end, name, item in loci:
+            if chrm not in chrm2recs:
+                chrm2recs[chrm] = []
+            chrm2recs[chrm].append((beg, end, name, item))
+
+        self.chrm2idx = {}
+        for chrm, recs in chrm2recs.items():
+            recs.sort(key=lambda r: r[:3])
+            begs = array('i', [r[0] for r in recs])
+            ends = array('i', [r[1] for r in recs])
+            ids = [r[3] for r in recs]
+            maxends = array('i', ends)
+            for k in range(1, len(maxends)):
+                if maxends[k] < maxends[k-1]:
+                    maxends[k] = maxends[k-1]
+            # ranks in the order of end, ties broken by .loc_idx order
+            by_end = sorted(range(len(recs)), key=lambda k: (ends[k], k))
+            sorted_ends = array('i', [ends[k] for k in by_end])
+            end_ids = [ids[k] for k in by_end]
+            self.chrm2idx[chrm] = (begs, ends, maxends, ids, sorted_ends, end_ids)
+
+    @classmethod
+    def from_trnx_bin(cls, trnx_bin):
+
+        def _loci():
+            for i in range(len(trnx_bin)):
+                chrm, beg, end, name = trnx_bin.locus(i)
+                yield chrm, beg, end, name, i
+
+        return cls(_loci())
+
+    @classmethod
+    def from_loc_idx(cls, loc_idx_fn):
+
+        """ read the bgzipped .loc_idx once, keep only the coordinates """
+        def _loci():
+            import gzip
+            for line in gzip.open(loc_idx_fn, 'rt'):
+                fields = line.split('\t', 5)
+                beg = int(fields[1])
+                end = int(fields[2])
+                yield fields[0], beg, end, fields[4], (beg, end, fields[4])
+
+        return cls(_loci())
+
+    def overlap(self, chrm, beg, end):
+
+        """ record indices of transcripts overlapping [beg, end] """
+        if chrm not in self.chrm2idx:
+            return []
+        # an inverted range (e.g., a no-op MNV) is empty, as in tabix
+        if end <= max(0, beg-1):
+            return []
+        begs, ends, maxends, ids, _, _ = self.chrm2idx[chrm]
+        lo = bisect_left(maxends, beg)
+        hi = bisect_left(begs, end)
+        return [ids[k] for k in range(lo, hi) if ends[k] >= beg]
+
+    def closest_upstream(self, chrm, pos):
+
+        """ record index of the transcript with the greatest end before pos """
+        if chrm not in self.chrm2idx:
+            return None
+        sorted_ends, end_ids = self.chrm2idx[chrm][4:]
+        k = bisect_left(sorted_ends, pos)
+        if k == 0:
+            return None
+        # the first in .loc_idx order among those sharing the end
+        k = bisect_left(sorted_ends, sorted_ends[k-1])
+        return end_ids[k]
+
+    def closest_downstream(self, chrm, pos):
+
+        """ record index of the transcript with the smallest begin after pos """
+        if chrm not in self.chrm2idx:
+            return None
+        begs, _, _, ids = self.chrm2idx[chrm][:4]
+        k = bisect_right(begs, pos)
+        if k == len(begs):
+            return None
+        return ids[k]
+
 class TransVarDB():
 
     """ hold transcripts and genes
@@ -50,9 +832,10 @@ class TransVarDB():
     Different from TransVarDB, FeatureDB is only indexed by coordinates.
     """
 
-    def __init__(self, dbfn=None, source=None):
+    def __init__(self, dbfn=None, source=None, loc_engine='tabix'):
 
         self.name2gene = {}
+        self.jobs = 1
         if dbfn is None: return
 
         self.dbfn = dbfn
@@ -69,6 +852,41 @@ class TransVarDB():
         self.idmap = None
         self.source = source
 
+        # binary transcript store, absent in databases built by older versions
+        self.trnx_bin = None
+        if os.path.exists(dbfn+'.trxn_bin'):
+            self.trnx_bin = TrnxBin(dbfn+'.trxn_bin')
+
+        # stored CDS and protein sequences, see TrnxSeq
+        # only used with the reference they were retrieved from
+        self.trnx_seq = None
+        if self.trnx_bin is not None and os.path.exists(dbfn+'.trxn_seq'):
+            self.trnx_seq = TrnxSeq(dbfn+'.trxn_seq')
+            if faidx.refgenome is not None and not self.trnx_seq.matches(self.trnx_bin):
+                err_warn('%s does not match the reference %s (built with %s), stored sequences are not used. Consider rerunning transvar index --store-seq' % (
+                    dbfn+'.trxn_seq', faidx.refgenome.fasta_file, self.trnx_seq.ref_path or 'an unrecorded reference'))
+                self.trnx_seq.close()
+                self.trnx_seq = None
+
+        # location queries either through tabix on .loc_idx
+        # or through an in-memory interval index ('interval')
+        self.loc_engine = loc_engine
+        self.interval_idx = None
+
+        # whether the whole database is preloaded, see load_all
+        self.mem = False
+
+        # transcript cache shared among databases, set by AnnoDB
+        self.cache = None
+
+    def reopen(self):
+
+        """ new handles for the files read through a file offset (e.g., after
+        fork, where the offset is shared with the parent), mappings are kept """
+        self.dbfh.close()
+        self.dbfh = open(self.dbfn, 'rt')
+        self.loc_idx = None
+
     ##########################
     # parsers for transvardb #
     ##########################
@@ -107,6 +925,11 @@ class TransVarDB():
         """ parse location-indexed transcript file
         return only 1 line
         """
+        if len(fields) > 13 and self.trnx_bin is not None:
+            i = self.trnx_bin.index(int(fields[13]))
+            if i is not None:
+                return self._decode(i)
+
         t = Transcript()
         t.chrm = fields[0]
         t.beg = int(fields[1])
@@ -125,26 +948,102 @@ class TransVarDB():
         t.source = self.source
         return t
 
-    def parse_all(self, name2gene, name2trnx):
+    def _decode(self, i):
 
-        """ parse the whole transcript file
-        this is for in-memory processing
-        """
+        """ the i-th transcript of the binary store, linked to its
+        stored sequences when present """
+        t = self.trnx_bin.decode(i, self.source)
+        if self.trnx_seq is not None:
+            j = self.trnx_seq.index(self.trnx_bin.txtposes[i])
+            if j is not None:
+                t.seq_store = (self.trnx_seq, j)
+        return t
+
+    def parse_trnx_at(self, pos):
+
+        """ parse the transcript at offset pos of the transvardb """
+        if self.trnx_bin is not None:
+            i = self.trnx_bin.index(pos)
+            if i is not None:
+                return self._decode(i)
+
+        self.dbfh.seek(pos)
+        return next(self.parse_trnx(), None)
+
+    def _cached(self, t):
+
+        """ the cached instance of t, which keeps the CDS
+        and PositionMap retrieved in previous queries """
+        if self.cache is None or t is None:
+            return t
+        return self.cache.get(t)
+
+    def parse_gene_at(self, pos, gname):
+
+        """ parse all the transcripts of gname starting from offset pos """
+        if self.trnx_bin is not None:
+            i = self.trnx_bin.index(pos)
+            if i is not None:
+                while i < len(self.trnx_bin):
+                    t = self._decode(i)
+                    if t.gene_name != gname:
+                        break
+                    yield t
+                    i += 1
+                return
+
+        self.dbfh.seek(pos)
+        for t in self.parse_trnx(gname=gname):
+            yield t
+
+    def parse_all(self):
+
+        """ parse the whole transcript file in the order of .transvardb """
+        if self.trnx_bin is not None:
+            for i in range(len(self.trnx_bin)):
+                yield self._decode(i)
+            return
 
         self.dbfh.seek(0)
-        for line in self.dbfh:
-            fields = line.strip('\n').split('\t')
-            t = parse_trnx_loc(fields)
-            if t.gene_name in name2gene:
-                g = name2gene[t.gene_name]
+        while True:
+            t = next(self.parse_trnx(), None)
+            if t is None:
+                break
+            yield t
+
+    def load_all(self):
+
+        """ preload the whole database for in-memory processing
+        gene, transcript and alias lookups are then served from dictionaries
+        and location lookups from the interval index, all sharing the same
+        Transcript objects across queries.
+        """
+        self.mem_genes = {}
+        self.mem_trnx = {}
+        self.mem_alias = {}
+        tpts = []
+        for t in self.parse_all():
+            if t.gene_name in self.mem_genes:
+                g = self.mem_genes[t.gene_name]
             else:
                 g = Gene(t.gene_name)
-                name2gene[t.gene_name] = g
+                self.mem_genes[t.gene_name] = g
             g.link_t(t)
-            if t.name not in name2trnx:
-                name2trnx[t.name] = []
-            name2trnx[t.name].append(t)
 
+            if t.name in self.mem_trnx:
+                self.mem_trnx[t.name].append(t)
+            else:
+                self.mem_trnx[t.name] = [t]
+
+            for alias in t.aliases:
+                if alias in self.mem_alias:
+                    self.mem_alias[alias].append(t)
+                else:
+                    self.mem_alias[alias] = [t]
+            tpts.append(t)
+
+        self.interval_idx = TrnxLocIndex((t.chrm, t.beg, t.end, t.name, t) for t in tpts)
+        self.mem = True
 
     ########################################################
     # retrieve transcripts by gene name or transcript name #
@@ -184,12 +1083,16 @@ class TransVarDB():
     def get_by_gene(self, name):
 
         """ get by gene name """
+        if self.mem:
+            if name in self.mem_genes:
+                yield self.mem_genes[name]
+            return
+
         if name in self.gene_idx:
             pos = self.gene_idx[name]
-            self.dbfh.seek(pos)
             g = Gene(name)
-            for t in self.parse_trnx(gname=name):
-                g.link_t(t)
+            for t in self.parse_gene_at(pos, name):
+                g.link_t(self._cached(t))
             yield g
 
     def get_by_trnx(self, name, version=None):
@@ -200,14 +1103,23 @@ class TransVarDB():
         if m:
             name = m.group(1)
             version = int(m.group(2))
+
+        if self.mem:
+            if name not in self.mem_trnx:
+                return None
+            # keep the transcripts linked to their full gene
+            tpts = self.mem_trnx[name]
+            g = Gene(tpts[0].gene_name)
+            g.tpts.extend(tpts)
+            return g
+
         if name not in self.trnx_idx:
             return None
 
         poses = self.trnx_idx[name] # transcript ID might not be unique
         g = None
         for pos in poses:
-            self.dbfh.seek(pos)
-            t = next(self.parse_trnx(), None)
+            t = self._cached(self.parse_trnx_at(pos))
             if t is None:
                 return None
             elif g is None:
@@ -220,6 +1132,23 @@ class TransVarDB():
     def get_by_alias(self, alias):
 
         """ read a gene by alias of transcripts """
+        if self.mem:
+            name2gene = {}
+            for t in self.mem_alias.get(alias, []):
+                if t.gene_name in name2gene:
+                    g = name2gene[t.gene_name]
+                else:
+                    g = Gene(t.gene_name)
+                    name2gene[g.name] = g
+                if t not in g.tpts:
+                    g.tpts.append(t)
+                    if not g.dbxref:
+                        g.dbxref = t.gene_dbxref
+
+            for g in name2gene.values():
+                yield g
+            return
+
         if self.alias_idx is None and os.path.exists(self.dbfn+'.alias_idx'):
             self.alias_idx = load(open(self.dbfn+'.alias_idx', 'rb'))
 
@@ -227,8 +1156,7 @@ class TransVarDB():
             poses = self.alias_idx[alias]
             name2gene = {}
             for pos in poses:
-                self.dbfh.seek(pos)
-                t = next(self.parse_trnx(), None)
+                t = self._cached(self.parse_trnx_at(pos))
                 if t is None:
                     continue
                 elif t.gene_name in name2gene:
@@ -252,6 +1180,34 @@ class TransVarDB():
                 err_die("Missing location index. Consider rerunning the transvar index command")
             self.loc_idx = tabix.open(idx_fn)
 
+    def _ensure_interval_idx(self):
+        if self.interval_idx is None:
+            if self.trnx_bin is not None:
+                self.interval_idx = TrnxLocIndex.from_trnx_bin(self.trnx_bin)
+            elif self.loc_engine == 'interval':
+                err_die("Missing binary transcript file (.trxn_bin) for the interval location engine. Consider rerunning the transvar index command")
+            else:
+                # nearest transcript queries only
+                idx_fn = self.dbfn+'.loc_idx'
+                if not os.path.exists(idx_fn):
+                    err_die("Missing location index. Consider rerunning the transvar index command")
+                self.interval_idx = TrnxLocIndex.from_loc_idx(idx_fn)
+
+    def _parse_interval_item(self, chrm, item):
+
+        """ transcript from an item of the interval index """
+        if self.mem:
+            return item
+
+        if self.trnx_bin is not None:
+            return self._cached(self._decode(item))
+
+        beg, end, name = item
+        for fields in self._iloc_query(chrm, beg, end+1):
+            if int(fields[1]) == beg and int(fields[2]) == end and fields[4] == name:
+                return self._cached(self.parse_trnx_loc(fields))
+        return None
+
     def _iloc_query(self, chrm, beg, end):
 
         self._ensure_loc_idx()
@@ -260,34 +1216,35 @@ class TransVarDB():
     def get_by_loc(self, chrm, beg, end=None, flanking=0):
 
         """ get transcript if between begin and end """
-        self._ensure_loc_idx()
         if not end: end = beg
         chrm = normalize_chrm(chrm)
+        if self.loc_engine == 'interval' or self.mem:
+            self._ensure_interval_idx()
+            for item in self.interval_idx.overlap(chrm, beg-flanking, end+flanking):
+                yield self._parse_interval_item(chrm, item)
+            return
+
+        self._ensure_loc_idx()
         for fields in self._iloc_query(chrm,beg-flanking,end+flanking):
-            yield self.parse_trnx_loc(fields)
+            yield self._cached(self.parse_trnx_loc(fields))
 
     def get_closest_upstream(self, chrm, pos):
+
+        """ transcript with the greatest end before pos """
         pos = int(pos)
         chrm = normalize_chrm(chrm)
-        s = 50000
-        for p in range(pos, -1, -s):
-            fs = [f for f in self._iloc_query(chrm, p-s, p) if int(f[2])<pos]
-            if fs:
-                fs.sort(key=lambda f:int(f[2]), reverse=True)
-                return self.parse_trnx_loc(fs[0])
-        return None
+        self._ensure_interval_idx()
+        item = self.interval_idx.closest_upstream(chrm, pos)
+        return None if item is None else self._parse_interval_item(chrm, item)
 
     def get_closest_downstream(self, chrm, pos):
+
+        """ transcript with the smallest begin after pos """
         pos = int(pos)
         chrm = normalize_chrm(chrm)
-        s = 50000
-        chrmlen = faidx.refgenome.chrm2len(chrm)
-        for p in range(pos, chrmlen, s):
-            fs = [f for f in self._iloc_query(chrm, p, p+s) if int(f[1])>pos]
-            if fs:
-                fs.sort(key=lambda f:int(f[1]))
-                return self.parse_trnx_loc(fs[0])
-        return None
+        self._ensure_interval_idx()
+        item = self.interval_idx.closest_downstream(chrm, pos)
+        return None if item is None else self._parse_interval_item(chrm, item)
 
     def get_closest(self, chrm, beg, end):
         """ closest transcripts upstream and downstream """
@@ -298,9 +1255,45 @@ class TransVarDB():
     # index transcripts from raw files ##
     #####################################
 
-    def index(self, raw_fns):
+    def raw_records(self, raw_fn, raw_format, chunksize=1<<16):
+
+        """ the (fields, info) of a GTF/GFF file, see parse_raw_chunk, in
+        file order. The file is read in chunks of about chunksize characters,
+        parsed by self.jobs worker processes when more than one. """
+        fh = opengz(raw_fn)
+        if self.jobs <= 1:
+            while True:
+                lines = fh.readlines(chunksize)
+                if not lines:
+                    break
+                for rec in parse_raw_chunk(raw_format, lines):
+                    yield rec
+            fh.close()
+            return
+
+        import multiprocessing
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            pending = []
+            while True:
+                lines = fh.readlines(chunksize)
+                if lines:
+                    pending.append(pool.apply_async(parse_raw_chunk, (raw_format, lines, True)))
+                # bounds the chunks held in memory
+                if pending and (len(pending) >= 2*self.jobs or not lines):
+                    for rec in pending.pop(0).get():
+                        yield rec
+                elif not lines:
+                    break
+        finally:
+            pool.terminate()
+            pool.join()
+            fh.close()
+
+    def index(self, raw_fns, store_seq=False, jobs=1):
 
         # each class that subclassed TransVarDB should have parse_raw
+        self.jobs = jobs
         self.parse_raw(*raw_fns)
         # set cds_beg and cds_end
         set_cds_boundary(self.name2gene)
@@ -313,12 +1306,14 @@ class TransVarDB():
         trnx_idx = {}
         alias_idx = {}
         tpts = []
+        bin_records = []
         for name in names:
             g = self.name2gene[name]
             for t in g.tpts:
                 t.gene_name = g.name
-                tpts.append((t.chrm, t.beg, t.end, t))
                 pos = dbfh.tell()
+                tpts.append((t.chrm, t.beg, t.end, pos, t))
+                bin_records.append((pos, t, g.dbxref))
                 if g.name not in gene_idx: # first location, each gene record one position
                     gene_idx[g.name] = pos
 
@@ -337,6 +1332,16 @@ class TransVarDB():
                            (g.name, t.name, t.version, t.transcript_type, t.beg, t.end, t.chrm,
                             t.strand, t.cds_beg, t.cds_end, t.exons, ';'.join(t.aliases), g.dbxref))
 
+        dbfh.close()
+
+        ## .trxn_bin - binary transcript records
+        TrnxBin.write(dbfn+'.trxn_bin', bin_records)
+
+        ## .trxn_seq - CDS and protein sequences
+        if store_seq:
+            err_print("writing CDS and protein sequences %s.trxn_seq" % dbfn)
+            TrnxSeq.write(dbfn+'.trxn_seq', [(pos, t) for pos, t, dbxref in bin_records])
+
         ## .gene_idx - index gene name
         idxfn = dbfn+'.gene_idx'
         dump(gene_idx, open(idxfn, 'wb'), 2)
@@ -352,12 +1357,13 @@ class TransVarDB():
 
         ## .loc_idx - tab-index genomic locations
         idxfn = dbfn+'.loc_idx'
-        tpts.sort()
+        tpts.sort(key=lambda x: (x[0], x[1], x[2], x[4]))
         s = ''
-        for chrm, beg, end, t in tpts:
-            s += '%s\t%d\t%d\t%s\t%s\t%d\t%s\t%s\t%d\t%d\t%s\t%s\t%s\n' % (
+        for chrm, beg, end, pos, t in tpts:
+            # the last column points to the record in .transvardb/.trxn_bin
+            s += '%s\t%d\t%d\t%s\t%s\t%d\t%s\t%s\t%d\t%d\t%s\t%s\t%s\t%d\n' % (
                 t.chrm, t.beg, t.end, t.gene_name, t.name, t.version, t.transcript_type,
-                t.strand, t.cds_beg, t.cds_end, t.exons, ';'.join(t.aliases), t.gene.dbxref)
+                t.strand, t.cds_beg, t.cds_end, t.exons, ';'.join(t.aliases), t.gene.dbxref, pos)
 
         ## call external tabix
         with open(idxfn, 'wb') as fh:
@@ -365,76 +1371,265 @@ class TransVarDB():
             p.communicate(input=s.encode('utf-8'))
         subprocess.check_call([tabix_path, '-p', 'bed', idxfn])
 
+class TabixIndex():
+
+    """ tabix index (.tbi) of a BGZF file of BED records, filled while
+    the records are written, queries find what they find with the index
+    of tabix -p bed, which also compresses the bins and adds the metadata
+    pseudo-bin """
+
+    def __init__(self):
+
+        self.tids = {}
+        self.bins = []          # tid => bin => [[voffset_beg, voffset_end]]
+        self.lidx = []          # tid => linear index
+        self.last_tid = -1
+        self.last_beg = -1
+        self.save = None        # [tid, bin, voffset] of the bin being filled
+        self.voff_end = 0
+        self.offset0 = None
+
+    @staticmethod
+    def reg2bin(beg, end):
+        end -= 1
+        if beg>>14 == end>>14: return 4681 + (beg>>14)
+        if beg>>17 == end>>17: return  585 + (beg>>17)
+        if beg>>20 == end>>20: return   73 + (beg>>20)
+        if beg>>23 == end>>23: return    9 + (beg>>23)
+        if beg>>26 == end>>26: return    1 + (beg>>26)
+        return 0
+
+    def add(self, chrm, beg, end, voff_beg, voff_end):
+
+        """ add the record [beg, end) (0-based) written from voff_beg to voff_end """
+        if chrm not in self.tids:
+            self.tids[chrm] = len(self.tids)
+            self.bins.append({})
+            self.lidx.append([])
+        tid = self.tids[chrm]
+        if beg < 0 or end < 0:
+            err_die('%s:%d-%d is out of bounds' % (chrm, beg, end))
+        if tid != self.last_tid:
+            if tid < self.last_tid:
+                err_die('the records of %s are not together, is the file sorted?' % chrm)
+            self.last_tid = tid
+            last_bin = None
+        else:
+            if self.last_beg > beg:
+                err_die('the records are out of order at %s:%d' % (chrm, beg+1))
+            last_bin = self.save[1]
+
+        # linear index, the first record overlapping each 16kb window
+        lidx = self.lidx[tid]
+        wbeg = beg >> 14
+        wend = (end-1) >> 14
+        if len(lidx) < wend+1:
+            lidx.extend([0] * (wend+1-len(lidx)))
+        for w in range(wbeg, wend+1):
+            if lidx[w] == 0:
+                lidx[w] = voff_beg
+        if voff_beg == 0:
+            self.offset0 = (wbeg, wend)
+
+        # binning index, chunks of consecutive records in the same bin
+        b = self.reg2bin(beg, end)
+        if b != last_bin:
+            if self.save is not None:
+                save_tid, save_bin, save_off = self.save
+                self.bins[save_tid].setdefault(save_bin, []).append([save_off, voff_beg])
+            self.save = [tid, b, voff_beg]
+        self.last_beg = beg
+        self.voff_end = voff_end
+
+    def write(self, fn):
+
+        if self.save is not None:
+            save_tid, save_bin, save_off = self.save
+            self.bins[save_tid].setdefault(save_bin, []).append([save_off, self.voff_end])
+        for bins in self.bins:
+            for b, chunks in bins.items():
+                merged = [chunks[0]]
+                for chunk in chunks[1:]:
+                    # chunks that meet in a BGZF block are read as one
+                    if merged[-1][1] >> 16 == chunk[0] >> 16:
+                        merged[-1][1] = chunk[1]
+                    else:
+                        merged.append(chunk)
+                bins[b] = merged
+        for lidx in self.lidx:
+            for w in range(1, len(lidx)):
+                if lidx[w] == 0:
+                    lidx[w] = lidx[w-1]
+        if self.offset0 is not None and self.lidx and self.lidx[0]:
+            wbeg, wend = self.offset0
+            for w in range(wbeg, wend+1):
+                self.lidx[0][w] = 0
+
+        names = b''.join(c.encode('utf-8')+b'\0' for c in sorted(self.tids, key=self.tids.get))
+        out = [b'TBI\1', struct.pack('<i', len(self.tids)),
+               # preset (bed, 0-based), seq, begin and end columns, meta char, lines skipped
+               struct.pack('<6i', 0x10000, 1, 2, 3, ord('#'), 0),
+               struct.pack('<i', len(names)), names]
+        for bins, lidx in zip(self.bins, self.lidx):
+            out.append(struct.pack('<i', len(bins)))
+            for b in sorted(bins):
+                out.append(struct.pack('<Ii', b, len(bins[b])))
+                out.append(b''.join(struct.pack('<QQ', u, v) for u, v in bins[b]))
+            out.append(struct.pack('<i', len(lidx)))
+            out.append(struct.pack('<%dQ' % len(lidx), *lidx))
+        with open(fn, 'wb') as fh:
+            w = BgzfWriter(fh)
+            w.write(b''.join(out))
+            w.close()
+
+def _feature_key(line):
+    chrm, beg, rest = line.split('\t', 2)
+    return (chrm, int(beg), line)
+
+def _feature_run(raw_format, lines, run_fn):
+
+    """ parse and sort a chunk of the raw feature file into a run """
+    recs = getattr(FeatureDB(), 'parse_'+raw_format)(lines)
+    recs.sort()
+    with open(run_fn, 'wt') as fh:
+        fh.writelines(line for chrm, beg, line in recs)
+    return run_fn
+
 class FeatureDB():
 
-    def parse_bed(self, bed_fn, db_fn):
+    """ a feature track (BED, GFF or VCF) indexed as
+    <raw file>.featuredb, BGZF of BED records with a tabix index
+    The raw file is parsed in chunks, sorted in runs of at most runsize
+    characters (by jobs worker processes), merged and written with its
+    index, without external commands.
+    """
+
+    def __init__(self, jobs=1, runsize=1<<26):
+
+        self.jobs = jobs
+        self.runsize = runsize
+
+    def parse_bed(self, lines):
 
         """ bed format indexing takes only the first four columns,
         the annotation is the fourth column
         """
-        bed_fh = opengz(bed_fn)
-        with open(db_fn+'.presort', 'wt') as outfile:
-            for line in bed_fh:
-                fields = line.strip('\n').split('\t')
-                if len(fields) < 4:
-                    continue
-                outfile.write('%s\t%s\t%s\t%s\n' % (
-                    normalize_chrm(fields[0]), fields[1], fields[2], fields[3]))
+        recs = []
+        for line in lines:
+            fields = line.rstrip('\n').split('\t', 4)
+            if len(fields) < 4 or not fields[1].isdigit():
+                continue
+            chrm = normalize_chrm(fields[0])
+            recs.append((chrm, int(fields[1]), '\t'.join(
+                (chrm, fields[1], fields[2], fields[3]))+'\n'))
+        return recs
 
-    def parse_gff(self, gff_fn, db_fn):
+    def parse_gff(self, lines):
 
         """ GFF: seqname, source, feature, start, end, score, strand, frame, attribute
         indexing made a bed file with seqname, start, end, feature
         """
-        gff_fh = opengz(gff_fn)
-        with open(db_fn+'.presort', 'wt') as outfile:
-            for line in gff_fh:
-                fields = line.strip('\n').split('\t')
-                if len(fields) < 4:
-                    continue
-                outfile.write('%s\t%s\t%s\t%s\n' % (
-                    normalize_chrm(fields[0]), fields[3], fields[4], fields[2]))
+        recs = []
+        for line in lines:
+            fields = line.rstrip('\n').split('\t', 5)
+            if len(fields) < 5 or not fields[3].isdigit():
+                continue
+            chrm = normalize_chrm(fields[0])
+            recs.append((chrm, int(fields[3]), '\t'.join(
+                (chrm, fields[3], fields[4], fields[2]))+'\n'))
+        return recs
 
-    def parse_vcf(self, vcf_fn, db_fn):
+    def parse_vcf(self, lines):
 
         """ VCF: #CHROM, POS, ID, REF, ALT, QUAL, FILTER, INF,
         indexing made a bed file with CHROM, POS, POS+len(REF), ID|REF|ALT """
-        vcf_fh = opengz(vcf_fn)
-        with open(db_fn+'.presort', 'wt') as outfile:
-            for line in vcf_fh:
-                if line.startswith('#'):
-                    continue
-                fields = line.strip('\n').split('\t')
-                if len(fields) < 7:
-                    continue
-                outfile.write('%s\t%s\t%d\t%s|%s|%s\n' % (
-                    normalize_chrm(fields[0]), fields[1], int(fields[1])+len(fields[3]),
-                    fields[2],fields[3],fields[4]))
+        recs = []
+        for line in lines:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t', 7)
+            if len(fields) < 7:
+                continue
+            chrm = normalize_chrm(fields[0])
+            pos = int(fields[1])
+            recs.append((chrm, pos, '\t'.join(
+                (chrm, fields[1], str(pos+len(fields[3])),
+                 '|'.join((fields[2], fields[3], fields[4]))))+'\n'))
+        return recs
+
+    def _chunks(self, fn):
+
+        fh = opengz(fn)
+        while True:
+            lines = fh.readlines(self.runsize)
+            if not lines:
+                break
+            yield lines
+        fh.close()
+
+    def _sorted_recs(self, fn, raw_format, tmpdir):
+
+        """ external merge sort, each chunk is sorted into a run file,
+        then the runs are merged """
+        run_fns = []
+        try:
+            if self.jobs > 1:
+                import multiprocessing
+                pool = multiprocessing.Pool(self.jobs)
+                try:
+                    pending = []
+                    for lines in self._chunks(fn):
+                        # bounds the chunks held in memory
+                        if len(pending) >= 2*self.jobs:
+                            pending.pop(0).get()
+                        run_fns.append(os.path.join(tmpdir, 'run%d' % len(run_fns)))
+                        pending.append(pool.apply_async(_feature_run, (raw_format, lines, run_fns[-1])))
+                    for r in pending:
+                        r.get()
+                finally:
+                    pool.terminate()
+                    pool.join()
+            else:
+                for lines in self._chunks(fn):
+                    run_fns.append(os.path.join(tmpdir, 'run%d' % len(run_fns)))
+                    _feature_run(raw_format, lines, run_fns[-1])
+
+            runs = [open(run_fn, 'rt') for run_fn in run_fns]
+            for line in heapq.merge(*runs, key=_feature_key):
+                yield line
+            for run in runs:
+                run.close()
+        finally:
+            for run_fn in run_fns:
+                if os.path.exists(run_fn):
+                    os.remove(run_fn)
 
     def index(self, fn, raw_format, is_sorted):
+
         db_fn = fn+'.featuredb'
-        if raw_format == 'bed':
-            self.parse_bed(fn, db_fn)
-        elif raw_format == 'vcf':
-            self.parse_vcf(fn, db_fn)
-        elif raw_format == 'gff':
-            self.parse_gff(fn, db_fn)
-        else:
+        if raw_format not in ['bed', 'vcf', 'gff']:
             raise Exception('Unknown format, must be a bug.\n')
 
-        if is_sorted:
-            subprocess.check_call(['mv', db_fn+'.presort', db_fn+'.sort'])
-        else:
-            with open(db_fn+'.sort', 'wt') as outfile:
-                subprocess.check_call(['sort', '-T', os.path.dirname(os.path.abspath(db_fn)),
-                                       '-k', '1,1', '-k', '2,2n', db_fn+'.presort'], stdout=outfile)
-        with open(db_fn, 'wt') as outfile:
-            subprocess.check_call([bgzip_path, '-c', db_fn+'.sort'], stdout=outfile)
-        subprocess.check_call([tabix_path, '-p', 'bed', db_fn])
-
-        # clean
-        subprocess.check_call(['rm', '-f', db_fn+'.presort'])
-        subprocess.check_call(['rm', '-f', db_fn+'.sort'])
+        tmpdir = tempfile.mkdtemp(prefix='.featuredb', dir=os.path.dirname(os.path.abspath(db_fn)))
+        try:
+            if is_sorted:
+                parse = getattr(self, 'parse_'+raw_format)
+                lines = (line for chunk in self._chunks(fn) for chrm, beg, line in parse(chunk))
+            else:
+                lines = self._sorted_recs(fn, raw_format, tmpdir)
+
+            tbi = TabixIndex()
+            with open(db_fn, 'wb') as fh:
+                w = BgzfWriter(fh)
+                for line in lines:
+                    fields = line.split('\t', 3)
+                    voff = w.tell()
+                    w.write(line.encode('utf-8'))
+                    tbi.add(fields[0], int(fields[1]), int(fields[2]), voff, w.tell())
+                w.close()
+            tbi.write(db_fn+'.tbi')
+        finally:
+            shutil.rmtree(tmpdir)
 
 def set_cds_boundary(name2gene):
 
@@ -471,19 +1666,15 @@ class EnsemblDB(TransVarDB):
         """
 
         gtf_fh = opengz(gtf_fn)
+        new_version = gtf_fh.readline().startswith('#')
+        gtf_fh.close()
+        if not new_version:
+            self.parse_raw0(gtf_fn)
+            return
+
         id2ent = {}
         cnt = 0
-        new_version = False
-        for i, line in enumerate(gtf_fh):
-            if line.startswith('#'):
-                if i == 0:
-                    new_version = True
-                continue
-            if not new_version:
-                break
-            fields = line.strip('\n').split('\t')
-            info = dict(re.findall(r'\s*([^"]*) "([^"]*)";', fields[8]))
-            # info = dict([_.split('=') for _ in fields[8].split(';')])
+        for fields, info in self.raw_records(gtf_fn, 'ensembl'):
             if fields[2] == 'gene':
                 gene_id = info['gene_id']
                 if gene_id not in id2ent:
@@ -537,12 +1728,7 @@ class EnsemblDB(TransVarDB):
                     if info['protein_id'] not in t.aliases:
                         t.aliases.append(info['protein_id'])
 
-        if not new_version:
-            self.parse_raw0(gtf_fn)
-        else:
-            err_print("loaded %d transcripts from Ensembl GTF file." % cnt)
-
-        return
+        err_print("loaded %d transcripts from Ensembl GTF file." % cnt)
 
     def parse_raw0(self, gtf_fn):
         """
@@ -557,7 +1743,7 @@ class EnsemblDB(TransVarDB):
             if line.startswith('#'):
                 continue
             fields = line.strip().split('\t')
-            info = dict(re.findall(r'\s*([^"]*) "([^"]*)";', fields[8]))
+            info = dict(p_gtf_attr_ensembl.findall(fields[8]))
             if fields[2] == "exon":
                 if info['transcript_id'] in tid2transcript:
                     t = tid2transcript[info['transcript_id']]
@@ -662,16 +1848,9 @@ class RefSeqDB(TransVarDB):
     def parse_raw(self, gff_fn):
 
         id2ent = {}
-        gff_fh = opengz(gff_fn)
         reg = None
         cnt = 0
-        for line in gff_fh:
-            if line.startswith('#'): continue
-            fields = line.strip('\n').split('\t')
-            if (len(fields) < 9):
-                continue
-            # print line.strip()
-            info = dict([_.split('=') for _ in fields[8].split(';')])
+        for fields, info in self.raw_records(gff_fn, 'refseq'):
             if fields[2] == 'region':
                 if 'chromosome' in info:
                     reg = Region(info['chromosome'], int(fields[3]), int(fields[4]))
@@ -859,14 +2038,8 @@ class GENCODEDB(TransVarDB):
 
     def parse_raw(self, gencode_fn):
         id2ent = {}
-        gencode_fh = opengz(gencode_fn)
         cnt = 0
-        for line in gencode_fh:
-            # if cnt > 1000:
-            #     break
-            if line.startswith('#'): continue
-            fields = line.strip('\n').split('\t')
-            info = dict(re.findall(r'\s*([^";]*) "([^"]*)";', fields[8]))
+        for fields, info in self.raw_records(gencode_fn, 'gencode'):
             if fields[2] == 'gene':
                 gene_name = info['gene_name'].upper()
                 gid = info['gene_id']
@@ -1034,64 +2207,124 @@ class UCSCKnownGeneDB(TransVarDB):
 def main_index(args):
 
     """ this takes care of indexing
-    1) gene/transcripts;
-    2) other general features (TFBS, histone etc);
-    3) reference;
+    1) reference, first since sequences may be stored with the transcripts;
+    2) gene/transcripts;
+    3) other general features (TFBS, histone etc);
     4) alias to gene/transcripts
     """
 
+    # references, faidx for RefGenome and, on request, 2-bit packed for TwoBitGenome
+    if args.reference and args.reference != "_DEF_":
+        from . import config
+        config.samtools_faidx(args.reference)
+        if args.twobit:
+            err_print("writing 2-bit reference %s.2bit" % args.reference)
+            faidx.write_twobit(args.reference, args.reference+'.2bit')
+    elif args.twobit:
+        err_die('--twobit needs the reference, please specify --reference')
+
+    # sequences stored along with gene / transcripts, see TrnxSeq
+    store_seq = False
+    if args.store_seq:
+        reference = args.reference
+        if reference == '_DEF_':
+            from . import config
+            rv = args.refversion if args.refversion else 'hg19'
+            reference = get_config(config.read_config(), 'reference', rv)
+        if not reference:
+            err_die('--store-seq needs the reference, please specify --reference')
+        faidx.init_refgenome(reference)
+        store_seq = True
+
     # gene / transcripts
     if args.ensembl:
         db = EnsemblDB()
-        db.index([args.ensembl])
+        db.index([args.ensembl], store_seq, args.jobs)
 
     if args.ccds:
         db = CCDSDB()
-        db.index([args.ccds])
+        db.index([args.ccds], store_seq, args.jobs)
 
     if args.refseq:
         db = RefSeqDB()
-        db.index([args.refseq])
+        db.index([args.refseq], store_seq, args.jobs)
 
     if args.aceview:
         db = AceViewDB()
-        db.index([args.aceview])
+        db.index([args.aceview], store_seq, args.jobs)
 
     if args.gencode:
         db = GENCODEDB()
-        db.index([args.gencode])
+        db.index([args.gencode], store_seq, args.jobs)
 
     if args.kg:
         db = UCSCKnownGeneDB()
-        db.index([args.kg, args.alias])
+        db.index([args.kg, args.alias], store_seq, args.jobs)
 
     if args.ucsc:
         db = UCSCRefGeneDB()
-        db.index([args.ucsc])
+        db.index([args.ucsc], store_seq, args.jobs)
 
     # features
     if args.gff:
-        db = FeatureDB()
+        db = FeatureDB(args.jobs)
         db.index(args.gff, 'gff', args.sorted)
 
     if args.bed:
-        db = FeatureDB()
+        db = FeatureDB(args.jobs)
         db.index(args.bed, 'bed', args.sorted)
 
     if args.vcf:
-        db = FeatureDB()
+        db = FeatureDB(args.jobs)
         db.index(args.vcf, 'vcf', args.sorted)
 
+    # dbSNP, binary store for fast lookups
+    if args.dbsnp:
+        dbsnp = args.dbsnp
+        if dbsnp == '_DEF_':
+            from . import config
+            rv = args.refversion if args.refversion else 'hg19'
+            dbsnp = get_config(config.read_config(), 'dbsnp', rv)
+        if dbsnp:
+            err_print("writing binary dbSNP %s.snp_bin" % dbsnp)
+            DbsnpBin.write(dbsnp, dbsnp+'.snp_bin')
+
+    # all the FeatureDB tracks of the reference version merged, a merged
+    # store already configured is rebuilt with the re-indexed tracks
+    if args.merge_features or args.gff or args.bed or args.vcf:
+        from . import config
+        cfg = config.read_config()
+        if args.refversion:
+            rv = args.refversion
+        elif 'refversion' in cfg.defaults():
+            rv = cfg.get('DEFAULT', 'refversion')
+        else:
+            rv = 'hg19'
+        if not args.merge_features and cfg.has_section(rv) and cfg.has_option(rv, 'featuremerge'):
+            args.merge_features = cfg.get(rv, 'featuremerge')
+
+    if args.merge_features:
+        features = []
+        if cfg.has_section(rv):
+            for rname in cfg.options(rv):
+                featdb = cfg.get(rv, rname)
+                if featdb.endswith('.featuredb'):
+                    features.append((rname, featdb))
+        if not features:
+            err_die('no FeatureDB track configured for %s' % rv)
+        merged = args.merge_features
+        if merged == '_DEF_':
+            merged = os.path.join(os.path.dirname(features[0][1]), rv+'.featuremerge')
+        err_print("merging %d FeatureDB tracks into %s" % (len(features), merged))
+        FeatureBin.write(features, merged)
+        config.config_set(cfg, rv, 'featuremerge', merged)
+        config.save_config(cfg)
+
     # aliases
     if args.uniprot:
         tid2uniprot = parser.parse_uniprot_mapping(args.uniprot)
         dump(tid2uniprot, open(args.uniprot+'.idx','wb'), 2)
 
-    # references
-    if args.reference and args.reference != "_DEF_":
-        from . import config
-        config.samtools_faidx(args.reference)
-
 def add_parser_index(subparsers):
 
     p = subparsers.add_parser('index', help="index custom data base")
@@ -1100,6 +2333,13 @@ def add_parser_index(subparsers):
     p.add_argument('--vcf', nargs='?', default=None, const='_DEF_', help='Index a feature in VCF format')
     p.add_argument('--bed', nargs='?', default=None, const='_DEF_', help='Index a feature in BED format')
     p.add_argument('--sorted', action='store_true', help='feature is sorted, no need to redo sorting')
+    p.add_argument('--merge-features', dest='merge_features', nargs='?', default=None, const='_DEF_',
+                   help='merge all the FeatureDB tracks configured for the reference version into one store (config key: featuremerge), looked up once per variant, the store is rebuilt when --gff, --bed or --vcf is indexed')
+    p.add_argument('--dbsnp', nargs='?', default=None, const='_DEF_', help='convert the dbSNP VCF (config key: dbsnp) to a binary store (.snp_bin) for fast lookups')
+    p.add_argument('--twobit', action='store_true',
+                   help='also write the reference in 2-bit packed format (.2bit), about a quarter of the size of the fasta')
+    p.add_argument('--store-seq', dest='store_seq', action='store_true',
+                   help='store the CDS and protein sequences of the transcripts (.trxn_seq) for faster annotation, needs the reference')
     p.set_defaults(func=main_index)
 
 def main():
@@ -256,7 +256,7 @@ def decompose_mut(q):
 def annotate_mnv_gdna(args, q, db):
 
     # check reference sequence
-    gnuc_refseq = faidx.refgenome.fetch_sequence(q.tok, q.beg, q.end)
+    gnuc_refseq = faidx.getseq(q.tok, q.beg, q.end)
     if q.refseq and gnuc_refseq != q.refseq:
 
         r = Record(is_var=True)
@@ -0,0 +1,375 @@
+"""
+The MIT License
+
+Copyright (c) 2015
+The University of Texas MD Anderson Cancer Center
+Wanding Zhou, Tenghui Chen, Ken Chen (kchen3@mdanderson.org)
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import re, argparse
+from . import faidx
+from .err import *
+from .utils import opengz, double_trim, normalize_chrm, get_config
+from .config import read_config
+from .mutation import parse_tok_mutation_str
+from .record import QuerySNV, QueryDEL, QueryINS, QueryMNV, QueryDUP
+from .transcripts import roll_left_del, roll_left_ins
+from .output import init_output, write_line
+
+class RefWindow():
+
+    """ reference sequence around the current position of a sorted
+    stream of variants. The window grows forward as the stream moves on
+    and drops what falls far behind, so sorted input reads every part of
+    the reference once. It restarts on a new chromosome or when a query
+    jumps far back, unsorted input is correct but slower.
+    """
+
+    def __init__(self, chunk=1<<16):
+
+        self.chunk = chunk
+        self.chrm = None
+        self.chrmlen = 0
+        self.beg = 1
+        self.seq = ''
+        self.fetches = 0
+        self.nbases = 0
+
+    def _load(self, beg, end):
+
+        self.fetches += 1
+        self.nbases += end - beg + 1
+        return faidx.refgenome.fetch_sequence(self.chrm, beg, end)
+
+    def reset(self, chrm, beg):
+
+        name = faidx.check_window(faidx.refgenome.faidx, chrm, 1, 1)[0]
+        self.chrm = chrm
+        self.chrmlen = faidx.refgenome.faidx[name][0]
+        self.beg = max(1, beg - self.chunk // 4)
+        self.seq = ''
+
+    def fetch(self, chrm, beg, end):
+
+        """ reference from beg to end (1-based, inclusive) on chrm """
+
+        if chrm != self.chrm or beg < self.beg - 4*self.chunk:
+            self.reset(chrm, beg)
+        if beg < 1 or end > self.chrmlen:
+            raise WrongReferenceError('Invalid_position_%d_(expect_from_0_to_%d_at_%s)' % (
+                end if beg >= 1 else beg, self.chrmlen, chrm))
+        elif beg < self.beg:    # left alignment reaches behind the window
+            lo = max(1, min(beg, self.beg - self.chunk))
+            self.seq = self._load(lo, self.beg-1) + self.seq
+            self.beg = lo
+
+        if beg - self.beg > 2*self.chunk:
+            cut = beg - self.chunk - self.beg
+            self.seq = self.seq[cut:]
+            self.beg += cut
+
+        last = self.beg + len(self.seq) - 1
+        if end > last and last < self.chrmlen:
+            hi = min(self.chrmlen, max(end, last + self.chunk))
+            self.seq += self._load(last+1, hi)
+
+        return self.seq[beg-self.beg:end-self.beg+1]
+
+    def stats(self):
+        return 'reference window: %d fetches, %d bp' % (self.fetches, self.nbases)
+
+def normalize_allele(chrm, pos, ref, alt, window):
+
+    """ left-align and trim ref>alt at pos, either may be empty
+    (as in HGVS) or carry padding bases (as in VCF).
+    return VCF style (pos, ref, alt), indels keep one padding base
+    """
+    ref = ref.upper()
+    alt = alt.upper()
+    if ref and window.fetch(chrm, pos, pos+len(ref)-1) != ref:
+        raise WrongReferenceError('invalid_reference_seq_%s;expect_%s' % (
+            ref, window.fetch(chrm, pos, pos+len(ref)-1)))
+
+    _ref, _alt, head_trim, tail_trim = double_trim(ref, alt)
+    pos += head_trim
+    if not _ref and not _alt:
+        raise InvalidInputError('no_variation_%s>%s' % (ref, alt))
+
+    if _ref and _alt:           # SNV and MNV
+        return pos, _ref, _alt
+
+    fetch = lambda beg, end: window.fetch(chrm, beg, end)
+    if _ref:                    # deletion
+        beg, end = roll_left_del(fetch, pos, pos+len(_ref)-1)
+        if beg > 1:
+            seq = fetch(beg-1, end)
+            return beg-1, seq, seq[0]
+        seq = fetch(beg, end+1)
+        return beg, seq, seq[-1]
+
+    # insertion, after pos-1
+    p, insseq = roll_left_ins(fetch, pos-1, _alt)
+    if p >= 1:
+        base = fetch(p, p)
+        return p, base, base+insseq
+    base = fetch(1, 1)
+    return 1, base, insseq+base
+
+def query2allele(q, window):
+
+    """ convert a gDNA query to (chrm, pos, ref, alt) in HGVS style,
+    i.e., without padding base """
+
+    fetch = lambda beg, end: window.fetch(q.tok, beg, end)
+    if isinstance(q, QuerySNV):
+        return q.tok, q.pos, q.ref or fetch(q.pos, q.pos), q.alt
+    if isinstance(q, QueryDEL):
+        return q.tok, q.beg, q.delseq or fetch(q.beg, q.end), ''
+    if isinstance(q, QueryINS):
+        return q.tok, q.pos+1, '', q.insseq
+    if isinstance(q, QueryMNV):
+        return q.tok, q.beg, q.refseq or fetch(q.beg, q.end), q.altseq
+    if isinstance(q, QueryDUP):
+        return q.tok, q.end+1, '', q.dupseq or fetch(q.beg, q.end)
+
+    raise InvalidInputError('not_a_variant_%s' % q.op)
+
+class _Seen():
+
+    """ normalized variants already output, on the current chromosome """
+
+    def __init__(self, uniq):
+        self.uniq = uniq
+        self.chrm = None
+        self.keys = set()
+
+    def check(self, v):
+
+        """ True if v is new (or uniq is off) """
+        if not self.uniq:
+            return True
+        if v[0] != self.chrm:
+            self.chrm = v[0]
+            self.keys.clear()
+        if v in self.keys:
+            return False
+        self.keys.add(v)
+        return True
+
+def normalize_variants(variants, window=None, uniq=False):
+
+    """ normalize a stream of (chrm, pos, ref, alt) into VCF style
+    left-aligned (chrm, pos, ref, alt). With uniq, variants normalized
+    to one already seen on the chromosome are skipped.
+    """
+    if window is None:
+        window = RefWindow()
+    seen = _Seen(uniq)
+    for chrm, pos, ref, alt in variants:
+        v = (normalize_chrm(chrm),) + normalize_allele(chrm, pos, ref, alt, window)
+        if seen.check(v):
+            yield v
+
+def normalize_hgvs(strs, window=None, uniq=False):
+
+    """ normalize a stream of gDNA HGVS strings (e.g., chr7:g.140453136A>T)
+    into VCF style (chrm, pos, ref, alt) """
+
+    if window is None:
+        window = RefWindow()
+    return normalize_variants(
+        (query2allele(parse_tok_mutation_str(s, 'g'), window) for s in strs),
+        window, uniq)
+
+p_vcf_number = re.compile(r'^##(INFO|FORMAT)=<ID=([^,>]+),Number=([^,>]+)')
+p_gt_allele = re.compile(r'\d+')
+
+def split_values(values, number, k, nalt):
+
+    """ values of a Number=A, R or G field for the k-th (1-based) of nalt
+    alternative alleles, values that do not match the number are kept """
+    vs = values.split(',')
+    if number == 'A' and len(vs) == nalt:
+        return vs[k-1]
+    if number == 'R' and len(vs) == nalt+1:
+        return vs[0]+','+vs[k]
+    if number == 'G':
+        if len(vs) == (nalt+1)*(nalt+2)//2: # diploid, genotype a/b at b(b+1)/2+a
+            j = k*(k+1)//2
+            return ','.join((vs[0], vs[j], vs[j+k]))
+        if len(vs) == nalt+1:               # haploid
+            return vs[0]+','+vs[k]
+    return values
+
+def split_record(fields, k, nalt, numbers):
+
+    """ fields of a multiallelic VCF record split to its k-th (1-based) ALT
+    as bcftools norm -m- does: INFO and FORMAT fields declared Number=A, R
+    or G keep the values of the allele, GT calls the other ALTs reference.
+    numbers are the declared Number of the INFO and FORMAT fields by ID.
+    """
+    fields = fields[:]
+    if len(fields) > 7 and fields[7] != '.':
+        info = []
+        for kv in fields[7].split(';'):
+            key, eq, values = kv.partition('=')
+            number = numbers['INFO'].get(key)
+            if eq and number in ('A', 'R', 'G'):
+                kv = key+'='+split_values(values, number, k, nalt)
+            info.append(kv)
+        fields[7] = ';'.join(info)
+
+    if len(fields) > 9:
+        keys = fields[8].split(':')
+        for i in range(9, len(fields)):
+            values = fields[i].split(':')
+            for j, key in enumerate(keys[:len(values)]):
+                number = numbers['FORMAT'].get(key)
+                if key == 'GT':
+                    values[j] = p_gt_allele.sub(
+                        lambda m: '1' if int(m.group()) == k else '0', values[j])
+                elif number in ('A', 'R', 'G'):
+                    values[j] = split_values(values[j], number, k, nalt)
+            fields[i] = ':'.join(values)
+
+    return fields
+
+def main_vcf(args, window, seen):
+
+    numbers = {'INFO': {}, 'FORMAT': {}}
+    for line in opengz(args.vcf):
+        if line.startswith('#'):
+            m = p_vcf_number.match(line)
+            if m:
+                numbers[m.group(1)][m.group(2)] = m.group(3)
+            write_line(line.rstrip('\n'))
+            continue
+
+        record = line.rstrip('\n').split('\t')
+        chrm, pos, ref = record[0], int(record[1]), record[3]
+        alts = record[4].split(',')
+        for k, alt in enumerate(alts, 1):
+            fields = record
+            if len(alts) > 1:
+                fields = split_record(record, k, len(alts), numbers)
+            v = (chrm, pos, ref, alt)
+            if not (alt.startswith('<') or alt in ('.', '*') or not ref.isalpha()):
+                try:
+                    v = (chrm,) + normalize_allele(chrm, pos, ref, alt, window)
+                except Exception as e:
+                    err_warn('%s: %s' % (line.rstrip('\n'), str(e)))
+                    if args.suspend:
+                        raise e
+            if seen.check(v):
+                fields[1] = str(v[1])
+                fields[3] = v[2]
+                fields[4] = v[3]
+                write_line('\t'.join(fields))
+
+def _main_one(args, s, window, seen):
+
+    try:
+        q = parse_tok_mutation_str(s, 'g')
+        q.op = s
+        chrm, pos, ref, alt = query2allele(q, window)
+        v = (normalize_chrm(chrm),) + normalize_allele(chrm, pos, ref, alt, window)
+    except Exception as e:
+        err_warn('%s: %s' % (s, str(e)))
+        if args.suspend:
+            raise e
+        write_line('%s\t.\t.\t.\t.\tError_%s' % (s, str(e)))
+        return
+
+    if seen.check(v):
+        write_line('%s\t%s\t%d\t%s\t%s\t.' % ((s,) + v))
+
+def main(args):
+
+    config = read_config()
+    if args.refversion:
+        rv = args.refversion
+    elif 'refversion' in config.defaults():
+        rv = config.get('DEFAULT', 'refversion')
+    else:
+        rv = 'hg19'
+    if args.reference == '_DEF_':
+        args.reference = get_config(config, 'reference', rv)
+    if not args.reference:
+        err_die('normalize needs a reference, please specify --reference')
+
+    faidx.init_refgenome(args.reference)
+    init_output(args)
+    window = RefWindow()
+    seen = _Seen(args.uniq)
+
+    if args.vcf:
+        main_vcf(args, window, seen)
+
+    if (args.l or args.i) and not args.noheader:
+        write_line('input\tchrom\tpos\tref\talt\tinfo')
+
+    if args.l:
+        if args.skipheader:
+            args.l.readline()
+        for line in args.l:
+            if args.d == 's':
+                fields = line.strip().split()
+            else:
+                fields = line.strip().split(args.d)
+            _main_one(args, fields[args.m-1].strip(), window, seen)
+
+    if args.i:
+        _main_one(args, args.i, window, seen)
+
+    if args.verbose > 0:
+        err_print(window.stats())
+
+def add_parser_normalize(subparsers):
+
+    p = subparsers.add_parser('normalize', help='left-align and trim gDNA variants')
+    p.add_argument('-i', default=None,
+                   help='<chrm>:<gDNA mutation>, E.g., chr7:g.140453136A>T, chr12:g.25398285delC')
+    p.add_argument('-l', default=None, type=argparse.FileType('r'),
+                   help='gDNA mutation list file, sorted by position for best speed')
+    p.add_argument('--vcf', default=None,
+                   help='vcf input file (may be gzipped), sorted for best speed. multiallelic records are split, Number=A/R/G fields and GT per allele')
+    p.add_argument('-d', default="\t", help="table delimiter [\\t], use 's' for space.")
+    p.add_argument('-m', type=int, default=1, help='column for <chrm>:<gDNA mutation> (1-based)')
+    p.add_argument('--skipheader', action='store_true', help='skip header')
+    p.add_argument('--noheader', action='store_true', help='repress header print')
+    p.add_argument('--uniq', action='store_true',
+                   help='output a variant only once, when it normalizes to one seen on the same chromosome')
+    p.add_argument('--refversion', nargs='?', default=None,
+                   help='reference version (hg18, hg19, hg38 etc) (config key: refversion)')
+    p.add_argument('--reference', nargs='?', default='_DEF_',
+                   help='indexed reference fasta or 2-bit packed reference (config key: reference)')
+    p.add_argument('--output', default=None,
+                   help='output file, compressed with bgzip if ending with .gz [stdout]')
+    p.add_argument('--compress', default=None, choices=['gzip', 'bgzip'],
+                   help='compress the output')
+    p.add_argument('--suspend', action='store_true',
+                   help='suspend execution upon error, rather than warn and continue')
+    p.add_argument('-v', '--verbose', default=0, type=int,
+                   help="verbose level, higher output more debugging information [0]")
+    p.set_defaults(func=main)
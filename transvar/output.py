@@ -0,0 +1,270 @@
+"""
+The MIT License
+
+Copyright (c) 2015
+The University of Texas MD Anderson Cancer Center
+Wanding Zhou, Tenghui Chen, Ken Chen (kchen3@mdanderson.org)
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import sys
+import zlib
+import gzip
+import struct
+import atexit
+import threading
+
+class BgzfWriter():
+
+    """ write BGZF (blocked gzip, as bgzip) to binary stream fh
+    data are compressed in independent gzip members of at most
+    block_size bytes, the file ends with the empty EOF block """
+
+    block_size = 0xff00
+    eof = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+    def __init__(self, fh, level=6):
+
+        self.fh = fh
+        self.level = level
+        self.buf = bytearray()
+        self.coffset = 0        # where the block being filled will start
+
+    def tell(self):
+
+        """ virtual offset of the next byte written, as bgzf_tell """
+        return (self.coffset << 16) | len(self.buf)
+
+    def write(self, data):
+
+        self.buf.extend(data)
+        while len(self.buf) >= self.block_size:
+            self._write_block(bytes(self.buf[:self.block_size]))
+            del self.buf[:self.block_size]
+
+    def _write_block(self, data):
+
+        c = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = c.compress(data) + c.flush()
+        # ID1 ID2 CM FLG MTIME XFL OS XLEN SI1 SI2 SLEN BSIZE
+        self.fh.write(struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255,
+                                  6, 66, 67, 2, len(cdata)+25))
+        self.fh.write(cdata)
+        self.fh.write(struct.pack('<2I', zlib.crc32(data) & 0xffffffff, len(data)))
+        self.coffset += len(cdata) + 26
+
+    def flush(self):
+
+        if self.buf:
+            self._write_block(bytes(self.buf))
+            self.buf = bytearray()
+        self.fh.flush()
+
+    def close(self):
+
+        self.flush()
+        self.fh.write(self.eof)
+        self.fh.flush()
+
+class OutputSink():
+
+    """ buffered output of annotation
+    Text is gathered and written in blocks of at least bufsize
+    characters, either to the text stream fh or, when compress is gzip
+    or bgzip, compressed to the binary stream fh.
+    """
+
+    def __init__(self, fh, compress=None, bufsize=1<<20):
+
+        self.compress = compress
+        if compress == 'gzip':
+            self.fh = gzip.GzipFile(fileobj=fh, mode='wb')
+        elif compress == 'bgzip':
+            self.fh = BgzfWriter(fh)
+        else:
+            self.fh = fh
+        self.bufsize = bufsize
+        self.buf = []
+        self.buflen = 0
+
+    def write(self, s):
+
+        self.buf.append(s)
+        self.buflen += len(s)
+        if self.buflen >= self.bufsize:
+            self._write_buf()
+
+    def _write_buf(self):
+
+        s = ''.join(self.buf)
+        self.buf = []
+        self.buflen = 0
+        if self.compress:
+            self.fh.write(s.encode('utf-8'))
+        else:
+            self.fh.write(s)
+
+    def flush(self):
+
+        self._write_buf()
+        self.fh.flush()
+
+    def close(self):
+
+        """ flush and terminate the compressed stream, fh is left open """
+        self._write_buf()
+        if self.compress:
+            self.fh.close()
+        self.fh.flush()
+
+# the sink annotation output goes to, see init_output
+sink = OutputSink(sys.stdout)
+
+def init_output(args):
+
+    """ set up the output sink from --output and --compress """
+    global sink
+    compress = args.compress
+    if args.output and args.output != '-':
+        if compress is None and args.output.endswith('.gz'):
+            compress = 'bgzip'
+        fh = open(args.output, 'wb' if compress else 'w')
+    else:
+        fh = sys.stdout.buffer if compress else sys.stdout
+
+    sink = OutputSink(fh, compress)
+
+def set_output(s):
+
+    """ redirect output to s (e.g., a StringIO), return the previous sink """
+    global sink
+    prev = sink
+    sink = s
+    return prev
+
+def close_output():
+
+    try:
+        sink.close()
+    except (IOError, ValueError): # e.g., closed pipe or stream
+        pass
+
+atexit.register(close_output)
+
+def write_output(s):
+
+    """ write annotation output """
+    try:
+        sink.write(s)
+    except IOError:             # e.g., closed pipe
+        sys.exit(1)
+
+def write_line(s):
+
+    """ write one line of annotation output """
+    write_output(s+'\n')
+
+class ReorderWriter():
+
+    """ write chunks of output in sequence order
+    Chunks are reserved in sequence by the producer and put, possibly
+    out of order and from other threads, as (sequence number, text). A
+    chunk is held until all the preceding ones are written. reserve()
+    blocks while maxpending chunks are reserved but not yet written, which
+    bounds the memory held by out-of-order chunks and throttles the producer
+    to the speed of the consumer. Text is written in blocks of at least
+    bufsize characters.
+    """
+
+    def __init__(self, fh, maxpending, bufsize=1<<20):
+
+        self.fh = fh
+        self.maxpending = maxpending
+        self.bufsize = bufsize
+        self.cond = threading.Condition()
+        self.nreserved = 0      # number of chunks reserved
+        self.nwritten = 0       # number of chunks written, i.e., next to write
+        self.seq2chunk = {}
+        self.buf = []
+        self.buflen = 0
+        self.error = None       # exception interrupting the output
+
+    def reserve(self):
+
+        """ sequence number of the next chunk """
+        with self.cond:
+            while (self.error is None and
+                   self.nreserved - self.nwritten >= self.maxpending):
+                self.cond.wait()
+            self._check()
+            seq = self.nreserved
+            self.nreserved += 1
+            return seq
+
+    def put(self, seq, text, e=None):
+
+        """ put chunk seq, e is the exception that interrupted it if any,
+        the output stops after that chunk """
+        with self.cond:
+            self.seq2chunk[seq] = (text, e)
+            while self.error is None and self.nwritten in self.seq2chunk:
+                text, e = self.seq2chunk.pop(self.nwritten)
+                self._write(text)
+                self.nwritten += 1
+                if e is not None:
+                    self._flush()
+                    self.error = e
+            self.cond.notify_all()
+
+    def close(self):
+
+        """ wait for all the reserved chunks and flush """
+        with self.cond:
+            while self.error is None and self.nwritten < self.nreserved:
+                self.cond.wait()
+            self._flush()
+            self._check()
+
+    def _write(self, text):
+
+        self.buf.append(text)
+        self.buflen += len(text)
+        if self.buflen >= self.bufsize:
+            self._flush()
+
+    def _flush(self):
+
+        try:
+            self.fh.write(''.join(self.buf))
+        except IOError as e:
+            self.error = e
+        self.buf = []
+        self.buflen = 0
+
+    def _check(self):
+
+        if self.error is None:
+            return
+        if isinstance(self.error, IOError): # e.g., closed pipe
+            sys.exit(1)
+        raise self.error
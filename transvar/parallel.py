@@ -0,0 +1,141 @@
+"""
+The MIT License
+
+Copyright (c) 2015
+The University of Texas MD Anderson Cancer Center
+Wanding Zhou, Tenghui Chen, Ken Chen (kchen3@mdanderson.org)
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+"""
+
+import copy
+import gc
+import multiprocessing
+from io import StringIO
+from .annodb import AnnoDB
+from . import output
+from .output import ReorderWriter, set_output, write_output
+from .config import read_config
+
+# per-process state of the workers, see _init_worker
+_worker = {}
+
+def _init_worker(args, process):
+
+    # the database is inherited from the parent, see parallel_main_list
+    _worker['db'].reopen()
+    _worker['args'] = args
+    _worker['process'] = process
+
+def _replay(items):
+
+    """ write the output produced while parsing each query in the parent
+    (e.g., parsing errors) right before annotating that query """
+    for pre, q, line in items:
+        if pre:
+            write_output(pre)
+        if q is not None:
+            yield q, line
+
+def _run_chunk(items):
+
+    """ annotate a chunk of queries, return the captured output and the
+    exception that interrupted the chunk, if any """
+    out = StringIO()
+    sink = set_output(out)
+    e = None
+    try:
+        _worker['process'](_worker['args'], _worker['db'],
+                           mutation_parser=_replay(items))
+    except Exception as _e:
+        e = _e
+    finally:
+        set_output(sink)
+
+    return out.getvalue(), e
+
+def _chunks(mutation_parser, chunksize):
+
+    """ group queries into chunks of (pre, q, line) where pre is what the
+    parser printed before yielding q """
+    items = []
+    while True:
+        pre = StringIO()
+        sink = set_output(pre)
+        try:
+            q, line = next(mutation_parser)
+        except StopIteration:
+            q = line = None
+        finally:
+            set_output(sink)
+        if q is None:
+            if pre.getvalue():
+                items.append((pre.getvalue(), None, None))
+            break
+        items.append((pre.getvalue(), q, line))
+        if len(items) >= chunksize:
+            yield items
+            items = []
+
+    if items:
+        yield items
+
+def parallel_main_list(args, mutation_parser, process, chunksize=1000):
+
+    """ annotate list or VCF input with args.jobs worker processes
+    process(args, db, mutation_parser=...) annotates an iterable of
+    (query, line) and writes to the output sink. The AnnoDB, with the
+    transcripts preloaded and the reference open, is built once in the parent
+    and shared with the forked workers. Queries are sent in chunks and the
+    output of the chunks is written in input order by a ReorderWriter.
+    """
+    # worker arguments cannot hold the input file handle, decide preloading here
+    wargs = copy.copy(args)
+    wargs.mem = args.mem or not args.nomem
+    wargs.sorted_input = args.sorted_input or bool(args.vcf)
+    wargs.l = None
+    wargs.vcf = None
+
+    _worker['db'] = AnnoDB(wargs, read_config())
+    if hasattr(gc, 'freeze'):
+        # the collector would otherwise write to (and copy) the shared pages
+        gc.freeze()
+
+    # forked workers must not inherit buffered output
+    output.sink.flush()
+    pool = multiprocessing.get_context('fork').Pool(args.jobs, _init_worker, (wargs, process))
+    writer = ReorderWriter(output.sink, 2*args.jobs)
+    try:
+        for items in _chunks(iter(mutation_parser), chunksize):
+            # blocks while too many chunks are in flight
+            seq = writer.reserve()
+            pool.apply_async(
+                _run_chunk, (items,),
+                callback=lambda r, seq=seq: writer.put(seq, *r),
+                error_callback=lambda e, seq=seq: writer.put(seq, '', e))
+        writer.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        _worker.clear()
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
@@ -668,7 +668,7 @@ def parser_add_annotation(parser):
     parser.add_argument('--refversion', nargs='?', default=None,
                         help='reference version (hg18, hg19, hg38 etc) (config key: refversion)')
     parser.add_argument('--reference', nargs='?', default='_DEF_',
-                        help='indexed reference fasta (with .fai) (config key: reference)')
+                        help='indexed reference fasta (with .fai, may be bgzipped with .gzi) or 2-bit packed reference (.2bit, see transvar index --twobit) (config key: reference)')
     parser.add_argument('--ensembl', nargs='?', default=None, const='_DEF_',
                         help='Ensembl GTF transcript annotation (config key: ensembl)')
     parser.add_argument('--gencode', nargs='?', default=None, const='_DEF_',
@@ -690,8 +690,16 @@ def parser_add_annotation(parser):
     #                     help='A customized transcript table with sequence (config key: custom)')
     parser.add_argument('--uniprot', nargs='?', default=None, const='_DEF_',
                         help='use uniprot ID rather than gene id (config key: uniprot)')
-    parser.add_argument('--mem', action='store_true', help='for processing large input, preload indices')
+    parser.add_argument('--mem', action='store_true', help='preload transcript databases in memory (default for -l and --vcf inputs)')
+    parser.add_argument('--nomem', action='store_true', help='do not preload transcript databases, query the indices on disk')
+    parser.add_argument('--sorted-input', dest='sorted_input', action='store_true', help='input is sorted by coordinates, dbSNP is then read in one forward sweep (always for --vcf)')
+    parser.add_argument('--tcache', type=int, default=512, help='memory budget (MB) for caching transcripts and their sequences across queries without preloading, 0 to disable [512]')
+    parser.add_argument('--output', default=None, help='output file, compressed with bgzip if ending with .gz [stdout]')
+    parser.add_argument('--compress', default=None, choices=['gzip', 'bgzip'], help='compress the output')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes for -l and --vcf inputs, output keeps the input order [1]')
     parser.add_argument('--sql', action='store_true', help='SQL mode')
+    parser.add_argument('--loc-engine', dest='loc_engine', default='tabix', choices=['tabix', 'interval'],
+                        help='engine for location queries: tabix on the .loc_idx or an in-memory interval index (needs .trxn_bin) [tabix]')
     parser.add_argument('--prombeg', type=int, default=1000, help='promoter starts from n1 bases upstream of transcription start site (default: n1=1000)')
     parser.add_argument('--promend', type=int, default=0, help='promoter ends extends to n2 bases downstream of transcription start site (default: n2=0)')
 
@@ -31,6 +31,7 @@ import re, sys
 from .faidx import *
 from .utils import *
 from .err import *
+from .output import write_line
 import locale
 locale.setlocale(locale.LC_ALL, '')
 
@@ -86,12 +87,19 @@ def append_inf(f, a):
     else:
         return a
 
-class RegAnno():
+class RegAnno(object):
 
     """ annotating a single site
     generated by Transcript.describe()
     """
 
+    # t, intergenic, promoter, splice, tss and tes are only set when
+    # applicable, their presence is probed
+    __slots__ = ('exonic', 'exon', 'cds', 'UTR', 'intronic', 'intron_exon1',
+                 'intron_exon2', 'cds_beg', 'cds_end', 't', 'intergenic',
+                 'promoter', 'splice', 'tss', 'tes', 'dist2tss', 'start',
+                 'stop')
+
     def __init__(self):
         self.exonic = False
         self.exon = None
@@ -247,12 +255,19 @@ class RegCDSAnno():
 
         return 'inside_[%s]' % self.format0()
 
-class RegSpanAnno():
+class RegSpanAnno(object):
 
     """ annotation of a span
     generated by Transcript.describe_span()
     """
 
+    # t, intergenic, promoter and the splice and cds crossings are only
+    # set when applicable, their presence is probed
+    __slots__ = ('b1', 'b2', 'spanning', 't', 'intergenic', 'promoter',
+                 'splice_donors', 'splice_acceptors', 'splice_both',
+                 'cover_cds', 'cover_exon', 'cross_start', 'cross_end',
+                 'transcript_regs')
+
     def __init__(self): #, long_range=False):
 
         # self.whole_gene = False
@@ -538,7 +553,13 @@ def print_header_s():
 def print_header():
     return 'input\t'+print_header_s()
 
-class Record():
+class Record(object):
+
+    __slots__ = ('tname', 'chrm', 'gene', 'strand', 'reg', 'info', 'is_var',
+                 'csqn', 'pos', 'gnuc_pos', 'gnuc_ref', 'gnuc_alt',
+                 'gnuc_beg', 'gnuc_end', 'gnuc_range', 'tnuc_pos', 'tnuc_ref',
+                 'tnuc_alt', 'tnuc_range', 'taa_pos', 'taa_ref', 'taa_alt',
+                 'taa_range', 'natrefseq', 'refrefseq')
 
     def __init__(self, is_var=False):
 
@@ -550,18 +571,39 @@ class Record():
         self.info = '.'         # ;-separated key=value pair
         self.is_var = is_var    # whether the record is for a variant
         self.csqn = []
+        self.pos = None
+
+        self.gnuc_pos = None
+        self.gnuc_ref = None
+        self.gnuc_alt = None
+        self.gnuc_beg = None
+        self.gnuc_end = None
+        self.gnuc_range = None
+
+        self.tnuc_pos = None
+        self.tnuc_ref = None
+        self.tnuc_alt = None
+        self.tnuc_range = None
+
+        self.taa_pos = None
+        self.taa_ref = None
+        self.taa_alt = None
+        self.taa_range = None
+
+        self.natrefseq = None
+        self.refrefseq = None
 
     def tnuc(self):
         """ format in HGVS nomenclature e.g., c.12345A>T """
         s = 'c.'
-        if hasattr(self, 'tnuc_range') and self.tnuc_range:
+        if self.tnuc_range:
             s += self.tnuc_range
             if s == 'c.': return '.'
         else:
-            if hasattr(self, 'tnuc_pos') and self.tnuc_pos: s += str(self.tnuc_pos)
-            if hasattr(self, 'tnuc_ref') and self.tnuc_ref: s += self.tnuc_ref
+            if self.tnuc_pos: s += str(self.tnuc_pos)
+            if self.tnuc_ref: s += self.tnuc_ref
             s += '>'
-            if hasattr(self, 'tnuc_alt') and self.tnuc_alt: s += self.tnuc_alt
+            if self.tnuc_alt: s += self.tnuc_alt
             if s == 'c.>': return '.'
         return s
 
@@ -676,25 +718,25 @@ class Record():
 
         """ format in chr1:A12345T """
         s = self.chrm+':g.'
-        if hasattr(self, 'gnuc_range') and self.gnuc_range:
+        if self.gnuc_range:
             s += self.gnuc_range
         else:
-            if hasattr(self, 'gnuc_pos') and self.gnuc_pos: s += str(self.gnuc_pos)
-            if hasattr(self, 'gnuc_ref') and self.gnuc_ref: s += self.gnuc_ref
+            if self.gnuc_pos: s += str(self.gnuc_pos)
+            if self.gnuc_ref: s += self.gnuc_ref
             s += '>'
-            if hasattr(self, 'gnuc_alt') and self.gnuc_alt: s += self.gnuc_alt
+            if self.gnuc_alt: s += self.gnuc_alt
         if s == '.:g.>': return '.'
         return s
 
     def taa(self):
         """ format in HGVS nomenclature e.g., p.E545K """
         s = 'p.'
-        if hasattr(self, 'taa_range') and self.taa_range:
+        if self.taa_range:
             s += self.taa_range
         else:
-            if hasattr(self, 'taa_ref') and self.taa_ref: s += self.taa_ref
-            if hasattr(self, 'taa_pos') and self.taa_pos: s += str(self.taa_pos)
-            if hasattr(self, 'taa_alt') and self.taa_alt: s += self.taa_alt
+            if self.taa_ref: s += self.taa_ref
+            if self.taa_pos: s += str(self.taa_pos)
+            if self.taa_alt: s += self.taa_alt
         if s == 'p.': return '.'
         return s
 
@@ -705,11 +747,7 @@ class Record():
 
         s = op+'\t' if op else ''
         s += self.formats()
-
-        try:
-            print(s)
-        except IOError:
-            sys.exit(1)
+        write_line(s)
 
     def formats(self):
 
@@ -746,10 +784,7 @@ def format_records(records, qop, args):
         if args.oneline:
             s = qop+'\t' if qop else ''
             s += '\t|||\t'.join([r.formats() for r in records])
-            try:
-                print(s)
-            except IOError:
-                sys.exit(1)
+            write_line(s)
         else:
             for r in records:
                 r.format(qop)
@@ -305,7 +305,7 @@ def annotate_region_gdna_genic_point(args, q, reg):
 
     r.gnuc_pos = q.pos
     r.pos = q.pos
-    r.gnuc_ref = faidx.refgenome.fetch_sequence(q.tok, q.pos, q.pos)
+    r.gnuc_ref = faidx.getseq(q.tok, q.pos, q.pos)
     r.tnuc_pos = p
     r.tnuc_ref = r.gnuc_ref if c.strand == '+' else complement(r.gnuc_ref)
     r.append_info('codon_pos=%s' % ('-'.join(map(str, c.locs)),))
@@ -81,7 +81,7 @@ def annotate_snv_cdna(args, q, tpts, db):
             r.strand = t.strand
 
             r.gnuc_pos = t.tnuc2gnuc(qpos)
-            r.gnuc_ref = faidx.refgenome.fetch_sequence(t.chrm, r.gnuc_pos, r.gnuc_pos)
+            r.gnuc_ref = faidx.getseq(t.chrm, r.gnuc_pos, r.gnuc_pos)
             if t.strand == '+':
                 if q.ref and r.gnuc_ref != q.ref:
                     raise IncompatibleTranscriptError(
@@ -339,7 +339,7 @@ def annotate_snv_gdna(args, q, db):
         records (list of record.Record): a list of records
     """
 
-    gnuc_ref = faidx.refgenome.fetch_sequence(q.tok, q.pos, q.pos)
+    gnuc_ref = faidx.getseq(q.tok, q.pos, q.pos)
     if not q.ref:
         q.ref = gnuc_ref
 
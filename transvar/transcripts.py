@@ -31,9 +31,11 @@ import sys, re
 from . import faidx
 from .record import *
 from .utils import *
-from collections import deque
 import operator
 from functools import reduce
+from array import array
+from bisect import bisect_left, bisect_right
+from os.path import commonprefix
 
 def complement(base):
 
@@ -76,6 +78,29 @@ def codon2aa(codonseq):
         raise IncompatibleTranscriptError('Invalid_codon_sequence_%s' % codonseq)
     return standard_codon_table[codonseq]
 
+# table-driven translation: each base is coded in 2 bits (A, C, G, T as 0-3)
+# shifted to its place in the codon, anything else sets bit 6. The three
+# places OR-ed together give a codon index (0-63, or >= 64 for an invalid
+# codon) that one more translate maps to the amino acid, or '?'.
+_codon_place = [bytes(bytearray(
+    'ACGT'.index(chr(c)) << (4-2*j) if chr(c) in 'ACGT' else 0x40
+    for c in range(256))) for j in range(3)]
+_codon_index2aa = bytes(bytearray(
+    ord(standard_codon_table['ACGT'[c>>4]+'ACGT'[(c>>2)&3]+'ACGT'[c&3]]) if c < 64 else ord('?')
+    for c in range(256)))
+
+def translate_codons(seq):
+
+    """ amino acids of the complete codons in seq, translated in bulk
+    codons not in standard_codon_table (e.g., with N) are given as '?'
+    and translation does not stop at '*' """
+    b = seq.encode('latin-1', 'replace')
+    n = len(b) // 3
+    x = 0
+    for j in range(3):
+        x |= int.from_bytes(b[j:3*n:3].translate(_codon_place[j]), 'big')
+    return x.to_bytes(n, 'big').translate(_codon_index2aa).decode('ascii')
+
 reverse_codon_table = {
     'A': ['GCA', 'GCC', 'GCG', 'GCT'],
     'C': ['TGT', 'TGC'],
@@ -121,7 +146,9 @@ def aa2codon(aa):
 # site in codon follow the genomic order.
 # no matter the strand the positive or negative, first site has
 # the smallest genomic coordinate
-class Codon():
+class Codon(object):
+
+    __slots__ = ('gene', 'chrm', 'locs', 'strand', 'seq', 'index')
 
     # chrm, locs, strand
     def __init__(self):
@@ -254,7 +281,78 @@ def tnuc_range2gnuc_range_(np, tbeg, tend):
     except IndexError:
         raise IncompatibleTranscriptError('invalid_cDNA_range_[%d_%d];expect_[0_%d]' % (tbeg, tend, len(np)))
 
-class Transcript():
+class PositionMap():
+
+    """ map from 0-based cDNA coordinates to genomic coordinates
+    Behaves as the list of genomic positions of the coding bases in
+    transcript order (position array) but only stores the coding segment
+    of each exon and the cumulative coding length, so that memory is
+    constant per exon and mapping takes a bisection over the segments.
+    """
+
+    def __init__(self, exons, cds_beg, cds_end, strand):
+
+        self.strand = strand
+        self.begs = array('l')
+        self.ends = array('l')
+        self.cumlen = array('l', [0])
+        _exons = exons if strand == '+' else reversed(exons)
+        for ex_beg, ex_end in _exons:
+            beg = max(ex_beg, cds_beg)
+            end = min(ex_end, cds_end)
+            if beg <= end:
+                self.begs.append(beg)
+                self.ends.append(end)
+                self.cumlen.append(self.cumlen[-1]+end-beg+1)
+
+        # keys for genomic to cDNA bisection, increasing in transcript order
+        if strand == '+':
+            self.keys = self.ends
+        else:
+            self.keys = array('l', [-beg for beg in self.begs])
+
+    def __len__(self):
+        return self.cumlen[-1]
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('position map index out of range')
+
+        k = bisect_right(self.cumlen, i) - 1
+        if self.strand == '+':
+            return self.begs[k] + i - self.cumlen[k]
+        else:
+            return self.ends[k] - i + self.cumlen[k]
+
+    def locate(self, gpos):
+
+        """ 0-based index of the first coding base at or after gpos
+        in transcript direction, len(self) if there is none """
+        if self.strand == '+':
+            k = bisect_left(self.keys, gpos)
+            if k == len(self.keys):
+                return len(self)
+            return self.cumlen[k] + max(0, gpos - self.begs[k])
+        else:
+            k = bisect_left(self.keys, -gpos)
+            if k == len(self.keys):
+                return len(self)
+            return self.cumlen[k] + max(0, self.ends[k] - gpos)
+
+class Transcript(object):
+
+    # chrm, beg, end, cds_beg, cds_end are left unset until parsed and np
+    # until the position array is built, as their presence is probed
+    __slots__ = ('transcript_type', 'gene_name', 'strand', 'gene', 'seq',
+                 'name', 'exons', 'cds', 'aliases', 'version', 'source',
+                 'gene_dbxref', 'chrm', 'beg', 'end', 'cds_beg', 'cds_end',
+                 'np', 'seq_store')
 
     def __init__(self, transcript_type='protein_coding'):
 
@@ -271,6 +369,8 @@ class Transcript():
         self.aliases = []
         self.version = 255
         self.source = ''
+        self.gene_dbxref = ''
+        self.seq_store = None   # (TrnxSeq, record index) of stored sequences
 
     def __lt__(self, other):
         return self.name < other.name
@@ -312,6 +412,11 @@ class Transcript():
         return self.seq[beg-1:end]
 
     def get_proteinseq(self):
+        if self.seq_store is not None:
+            store, i = self.seq_store
+            protein = store.protein(i)
+            if protein is not None:
+                return protein
         self.ensure_seq()
         return translate_seq(self.seq)
 
@@ -356,20 +461,25 @@ class Transcript():
         potential reason include patch chromosomes
         """
         if self.seq: return
+        if self.seq_store is not None:
+            store, i = self.seq_store
+            self.seq = store.cds(i)
+            if self.seq is not None: return
         if not faidx.refgenome:
             err_die("please provide reference through --ref [reference fasta].")
 
-        seq = faidx.refgenome.fetch_sequence(self.chrm, self.beg, self.end)
-
-        if (not seq) or (len(seq) != self.end - self.beg + 1):
-            raise SequenceRetrievalError('failed_sequence_retrieval_length_%d;expect_length_%d' % (len(seq), self.end-self.beg+1))
-
-        segs = []
+        # fetch the CDS segments only, introns are never read
+        ranges = []
         for ex_beg, ex_end in self.exons:
             beg = max(ex_beg, self.cds_beg)
             end = min(ex_end, self.cds_end)
             if beg <= end:
-                segs.append(seq[beg-self.beg:end+1-self.beg])
+                ranges.append((beg, end))
+
+        segs = faidx.refgenome.fetch_ranges(self.chrm, ranges)
+        for (beg, end), seg in zip(ranges, segs):
+            if len(seg) != end - beg + 1:
+                raise SequenceRetrievalError('failed_sequence_retrieval_length_%d;expect_length_%d' % (len(seg), end-beg+1))
 
         self.seq = ''.join(segs)
         if self.strand == '-':
@@ -383,34 +493,28 @@ class Transcript():
         return self == self.gene.std_tpt
 
     def position_array(self):
-        if self.strand == "+":
-            np = []
-            for beg, end in self.exons:
-                np += list(range(max(beg, self.cds_beg),
-                            min(self.cds_end, end)+1))
-        else:
-            np = []
-            for beg, end in reversed(self.exons):
-                np += list(range(min(self.cds_end, end),
-                            max(beg, self.cds_beg)-1,-1))
-
-        return np
+        return PositionMap(self.exons, self.cds_beg, self.cds_end, self.strand)
 
     def tnuc_range2gnuc_range(self, tbeg, tend):
 
         """ convert transcript range to genomic range
         tbeg and tend are 1-based
         """
-        np = self.position_array()
-        # print self.
-        # print len(np)
-        # print tbeg, tend
+        if hasattr(self, 'np'):
+            np = self.np
+        else:
+            np = self.position_array()
         return tnuc_range2gnuc_range_(np, tbeg, tend)
 
     def taa2aa(self, taa):
         self.ensure_seq()
         if taa*3 > self.cdslen():
             raise IncompatibleTranscriptError('invalid_reference_protein_position_%d;expect_[0_%d]' % (taa, self.cdslen()//3))
+        if self.seq_store is not None and taa >= 1:
+            store, i = self.seq_store
+            protein = store.protein(i)
+            if protein is not None and taa <= len(protein):
+                return protein[taa-1]
         return codon2aa(self.seq[taa*3-3:taa*3])
 
     def taa_range2tnuc_seq(self, taa_beg, taa_end):
@@ -507,15 +611,10 @@ class Transcript():
         the last base is 300
         cpos is taa_pos
         """
-        self.ensure_seq()
+        self.ensure_position_array()
+        np = self.np
         cpos = int(cpos)
         if self.strand == "+":
-            np = []
-            for beg, end in self.exons:
-                np += list(range(max(beg, self.cds_beg),
-                            min(self.cds_end, end)+1))
-            assert len(np) == len(self.seq)
-
             ni = cpos*3
             if ni <= len(np):
                 codon        = Codon()
@@ -529,12 +628,6 @@ class Transcript():
             else:
                 raise IncompatibleTranscriptError('invalid_cDNA_position_%d;expect_[0_%d]' % (ni, len(np)))
         else:
-            np = []
-            for beg, end in reversed(self.exons):
-                np += list(range(min(self.cds_end, end),
-                            max(beg, self.cds_beg)-1,-1))
-            assert len(np) == len(self.seq)
-
             ni = cpos*3
             if ni <= len(np):
                 codon        = Codon()
@@ -666,34 +759,35 @@ class Transcript():
             c.locs = np[c.index*3-3:c.index*3]
             return c, p
 
-        for i, pos in enumerate(np):
+        i = np.locate(gpos)
+        if i < len(np):
+            pos = np[i]
             if gpos == pos:
                 c = self._init_codon_(i//3+1)
                 c.seq    = self.seq[i-i%3:i-i%3+3]
                 c.locs   = np[i-i%3:i-i%3+3]
                 p = Pos(i+1, 0)
                 return c, p
-            if gpos < pos:
-
-                if ((intronic_policy == 'closer' and gpos-np[i-1] < pos-gpos) or
-                    intronic_policy == 'c_smaller'):
+            # gpos is intronic, lies between np[i-1] and np[i]
+            if ((intronic_policy == 'closer' and gpos-np[i-1] < pos-gpos) or
+                intronic_policy == 'c_smaller'):
 
-                    p = Pos(i, gpos-np[i-1])
-                    ci = i//3+1
+                p = Pos(i, gpos-np[i-1])
+                ci = i//3+1
 
-                elif ((intronic_policy == 'closer' and gpos-np[i-1] >= pos-gpos) or
-                      intronic_policy == 'c_greater'):
+            elif ((intronic_policy == 'closer' and gpos-np[i-1] >= pos-gpos) or
+                  intronic_policy == 'c_greater'):
 
-                    p = Pos(i+1, gpos-pos)
-                    ci = (i+1)//3+1
+                p = Pos(i+1, gpos-pos)
+                ci = (i+1)//3+1
 
-                else:
-                    raise Exception('unknown_error')
+            else:
+                raise Exception('unknown_error')
 
-                c = self._init_codon_(ci)
-                c.seq = self.seq[ci*3-3:ci*3]
-                c.locs = np[ci*3-3:ci*3]
-                return c, p
+            c = self._init_codon_(ci)
+            c.seq = self.seq[ci*3-3:ci*3]
+            c.locs = np[ci*3-3:ci*3]
+            return c, p
 
     def _gpos2codon_n(self, gpos, np, intronic_policy):
 
@@ -711,7 +805,9 @@ class Transcript():
             c.locs = np[:3]
             return c, p
 
-        for i, pos in enumerate(np):
+        i = np.locate(gpos)
+        if i < len(np):
+            pos = np[i]
             if gpos == pos:
                 c = self._init_codon_(i//3+1)
                 c.seq = self.seq[i-i%3:i-i%3+3]
@@ -719,27 +815,26 @@ class Transcript():
                 p = Pos(i+1, 0)
                 return c, p
 
-            if gpos > pos:
-
-                if ((intronic_policy == 'closer' and np[i-1]-gpos < gpos-pos) or
-                    intronic_policy == 'c_smaller'):
+            # gpos is intronic, lies between np[i-1] and np[i]
+            if ((intronic_policy == 'closer' and np[i-1]-gpos < gpos-pos) or
+                intronic_policy == 'c_smaller'):
 
-                    p = Pos(i, np[i-1]-gpos)
-                    ci = i//3+1
+                p = Pos(i, np[i-1]-gpos)
+                ci = i//3+1
 
-                elif ((intronic_policy == 'closer' and np[i-1]-gpos >= gpos-pos) or
-                      intronic_policy == 'c_greater'):
+            elif ((intronic_policy == 'closer' and np[i-1]-gpos >= gpos-pos) or
+                  intronic_policy == 'c_greater'):
 
-                    p = Pos(i+1, pos-gpos)
-                    ci = (i+1)//3+1
+                p = Pos(i+1, pos-gpos)
+                ci = (i+1)//3+1
 
-                else:
-                    raise Exception('unknown_intronic_policy')
+            else:
+                raise Exception('unknown_intronic_policy')
 
-                c = self._init_codon_(ci)
-                c.seq = self.seq[ci*3-3:ci*3]
-                c.locs = np[ci*3-3:ci*3]
-                return c, p
+            c = self._init_codon_(ci)
+            c.seq = self.seq[ci*3-3:ci*3]
+            c.locs = np[ci*3-3:ci*3]
+            return c, p
 
     def ensure_position_array(self):
 
@@ -874,26 +969,24 @@ class Transcript():
 
         return regc
 
+    def taa_seq(self, beg, end):
+
+        """ protein sequence from codon beg to codon end (1-based),
+        codons that do not translate are given as '?' """
+
+        return translate_codons(self.seq[beg*3-3:end*3])
+
     def taa_roll_left_ins(self, index, taa_insseq):
 
         """ index is the position where the insertion comes after
         """
 
         self.ensure_seq()
-        _taa_insseq_ = deque(taa_insseq)
-        while True:
-            if index <= 1:
-                break
-            rightmost = _taa_insseq_[-1]
-            left_aa = translate_seq(
-                self.seq[(index-1)*3:index*3])
-            if rightmost != left_aa:
-                break
-            _taa_insseq_.pop()
-            _taa_insseq_.appendleft(left_aa)
-            index -= 1
+        p, insseq = roll_left_ins(self.taa_seq, index, taa_insseq, '?')
+        if p > 1:               # raise on the codon that stopped rolling
+            translate_seq(self.seq[(p-1)*3:p*3])
 
-        return index, ''.join(_taa_insseq_)
+        return p, insseq
 
     def taa_roll_right_ins(self, index, taa_insseq):
 
@@ -901,22 +994,12 @@ class Transcript():
         """
 
         self.ensure_seq()
-        _taa_insseq_ = deque(taa_insseq)
         taa_len = len(self.seq) // 3
-        while True:
-            if index + 1 >= taa_len:
-                break
-            leftmost = _taa_insseq_[0]
-            right_aa = translate_seq(
-                self.seq[index*3:(index+1)*3])
-            # print leftmost, right_aa, index
-            if leftmost != right_aa:
-                break
-            _taa_insseq_.popleft()
-            _taa_insseq_.append(right_aa)
-            index += 1
+        p, insseq = roll_right_ins(self.taa_seq, index, taa_insseq, taa_len-1, '?')
+        if p + 1 < taa_len:
+            translate_seq(self.seq[p*3:(p+1)*3])
 
-        return index, ''.join(_taa_insseq_)
+        return p, insseq
 
     def taa_roll_3p_ins(self, index, insseq):
 
@@ -929,15 +1012,10 @@ class Transcript():
     def taa_roll_left_del(self, taa_beg, taa_end):
 
         self.ensure_seq()
-        while True:
-            if taa_beg <= 1:
-                break
-            left_aa = self.cpos2aa(taa_beg-1)
-            rightmost = self.cpos2aa(taa_end)
-            if left_aa != rightmost:
-                break
-            taa_beg -= 1
-            taa_end -= 1
+        taa_beg, taa_end = roll_left_del(self.taa_seq, taa_beg, taa_end, '?')
+        if taa_beg > 1:
+            self.cpos2aa(taa_beg-1)
+            self.cpos2aa(taa_end)
 
         return taa_beg, taa_end
 
@@ -945,97 +1023,42 @@ class Transcript():
 
         self.ensure_seq()
         taa_len = len(self.seq) // 3
-        while True:
-            if taa_end + 1 >= taa_len:
-                break
-            right_aa = self.cpos2aa(taa_end+1)
-            leftmost = self.cpos2aa(taa_beg)
-            if leftmost != right_aa:
-                break
-            taa_beg += 1
-            taa_end += 1
+        taa_beg, taa_end = roll_right_del(self.taa_seq, taa_beg, taa_end, taa_len-1, '?')
+        if taa_end + 1 < taa_len:
+            self.cpos2aa(taa_end+1)
+            self.cpos2aa(taa_beg)
 
         return taa_beg, taa_end
 
+    def tnuc_seq(self, beg, end):
+
+        """ transcript sequence from beg to end (1-based) """
+
+        return self.seq[beg-1:end]
+
     def tnuc_roll_left_ins(self, p, tnuc_insseq):
 
         """ p is the position where insertion comes after """
 
         self.ensure_seq()
-        _tnuc_insseq_ = deque(tnuc_insseq)
-        while True:
-            if p <= 1:
-                break
-            left_base = self.seq[p-1]
-            right_most = _tnuc_insseq_[-1]
-            # print p, left_base, right_most
-            if left_base == 'N' or right_most == 'N':
-                break
-            if left_base != right_most:
-                break
-            _tnuc_insseq_.pop()
-            _tnuc_insseq_.appendleft(left_base)
-            p -= 1
-
-        return p, ''.join(_tnuc_insseq_)
+        return roll_left_ins(self.tnuc_seq, p, tnuc_insseq)
 
     def tnuc_roll_right_ins(self, p, tnuc_insseq):
 
         self.ensure_seq()
-        _tnuc_insseq_ = deque(tnuc_insseq)
-        tnuc_len = len(self.seq)
-        while True:
-            if p + 1 >= tnuc_len:
-                break
-            right_base = self.seq[p]
-            left_most = _tnuc_insseq_[0]
-            # print p, left_most, right_base
-            if right_base == 'N' or left_most == 'N':
-                break
-            if right_base != left_most:
-                break
-            _tnuc_insseq_.popleft()
-            _tnuc_insseq_.append(right_base)
-            p += 1
-
-        return p, ''.join(_tnuc_insseq_)
+        return roll_right_ins(self.tnuc_seq, p, tnuc_insseq, len(self.seq)-1)
 
     def tnuc_roll_left_del(self, beg, end):
 
         """ handles exonic region only """
 
         self.ensure_seq()
-        while True:
-            if beg <= 1:
-                break
-            left_base = self.seq[beg-2]
-            right_most = self.seq[end-1]
-            if left_base == 'N' or right_most == 'N':
-                break
-            if left_base != right_most:
-                break
-            beg -= 1
-            end -= 1
-
-        return beg, end
+        return roll_left_del(self.tnuc_seq, beg, end)
 
     def tnuc_roll_right_del(self, beg, end):
 
         self.ensure_seq()
-        tnuc_len = len(self.seq)
-        while True:
-            if end >= tnuc_len - 1:
-                break
-            right_base = self.seq[end]
-            left_most = self.seq[beg-1]
-            if right_base == 'N' or left_most == 'N':
-                break
-            if right_base != left_most:
-                break
-            beg += 1
-            end += 1
-
-        return beg, end
+        return roll_right_del(self.tnuc_seq, beg, end, len(self.seq)-1)
 
     def extend_taa_seq(self, taa_pos_base, old_seq, new_seq):
         """
@@ -1047,34 +1070,43 @@ class Transcript():
         new_aa_seq = ''
         i = 0
         while True:
+            # translate in bulk up to the first codon that is incomplete
+            # or invalid in either sequence
             ci = i*3
-            old_codon_seq = old_seq[ci:ci+3]
-            new_codon_seq = new_seq[ci:ci+3]
-            # if sequence comes to ends, extend sequence from reference file
-            if (old_codon_seq not in standard_codon_table or
-                new_codon_seq not in standard_codon_table):
-                seq_inc = faidx.refgenome.fetch_sequence(self.chrm, seq_end+1, seq_end+100)
-                old_seq += seq_inc
-                new_seq += seq_inc
-                old_codon_seq = old_seq[ci:ci+3]
-                new_codon_seq = new_seq[ci:ci+3]
-                seq_end += 100
-
-            taa_ref_run = codon2aa(old_codon_seq)
-            taa_alt_run = codon2aa(new_codon_seq)
-            new_aa_seq += taa_alt_run
-            # print i, old_codon_seq, new_codon_seq, taa_ref_run, taa_alt_run
-            if taa_pos == None and taa_ref_run != taa_alt_run:
-                taa_pos = i
-                taa_ref = taa_ref_run
-                taa_alt = taa_alt_run
-            if taa_alt_run == '*':
+            old_aa_run = translate_codons(old_seq[ci:])
+            new_aa_run = translate_codons(new_seq[ci:])
+            n = min(len(old_aa_run), len(new_aa_run))
+            bad = old_aa_run.find('?', 0, n)
+            if bad < 0: bad = n
+            k = new_aa_run.find('?', 0, bad)
+            if k >= 0: bad = k
+
+            stop = new_aa_run.find('*', 0, bad)
+            run_end = stop + 1 if stop >= 0 else bad
+            if taa_pos == None:
+                d = len(commonprefix([old_aa_run[:run_end], new_aa_run[:run_end]]))
+                if d < run_end:
+                    taa_pos = i + d
+                    taa_ref = old_aa_run[d]
+                    taa_alt = new_aa_run[d]
+            new_aa_seq += new_aa_run[:run_end]
+            if stop >= 0:
                 if taa_pos == None:
                     # stop codon encountered before difference
                     return None  # nothing occur to protein level
-                termlen = i + 1 - taa_pos
+                termlen = i + stop + 1 - taa_pos
                 break
-            i += 1
+
+            # if sequence comes to ends, extend sequence from reference file
+            i += bad
+            ci = i*3
+            seq_inc = faidx.refgenome.fetch_sequence(self.chrm, seq_end+1, seq_end+100)
+            old_seq += seq_inc
+            new_seq += seq_inc
+            seq_end += 100
+            # raise on codons that are still invalid
+            codon2aa(old_seq[ci:ci+3])
+            codon2aa(new_seq[ci:ci+3])
 
         new_aa_seq = new_aa_seq[taa_pos:]
         if taa_pos == None:
@@ -1134,89 +1166,165 @@ def gnuc_del_id(chrm, beg, end, args, gnuc_delseq=None):
 
     return '%sdel%s' % (gnuc_posstr, gnuc_delrep)
 
-def gnuc_roll_left_del(chrm, beg, end):
+def _match_left(a, b, stop='N'):
+
+    """ length of the common suffix of a and b (of equal length),
+    cut at the last stop character. Blocks of doubling size are
+    compared as strings so long repeats are not walked base by base.
+    """
+    n = len(a)
+    k = 0
+    blk = 16
+    while k < n:
+        m = min(blk, n-k)
+        if a[n-k-m:n-k] != b[n-k-m:n-k]:
+            while a[n-k-1] == b[n-k-1]:
+                k += 1
+            break
+        k += m
+        blk <<= 1
+
+    if k and stop:
+        i = a.rfind(stop, n-k)
+        if i >= 0:
+            k = n-1-i
+
+    return k
+
+def _match_right(a, b, stop='N'):
+
+    """ length of the common prefix of a and b, see _match_left """
+    n = len(a)
+    k = 0
+    blk = 16
+    while k < n:
+        m = min(blk, n-k)
+        if a[k:k+m] != b[k:k+m]:
+            while a[k] == b[k]:
+                k += 1
+            break
+        k += m
+        blk <<= 1
+
+    if k and stop:
+        i = a.find(stop, 0, k)
+        if i >= 0:
+            k = i
+
+    return k
+
+# rolling an indel by one position is valid when the base it moves onto
+# equals the base it vacates. Across a repeat region that holds for every
+# position where the sequence equals itself shifted by the indel length,
+# so the rolling distance is the length of that self-match. The functions
+# below fetch the flanking sequence in growing windows through fetch(beg,
+# end) (1-based, inclusive) and measure the self-match with _match_left
+# and _match_right. Rolling never goes below position 1 and never
+# compares beyond position last.
+
+def roll_left_del(fetch, beg, end, stop='N'):
 
     """ beg and end are 1st and last base in the deleted sequence """
 
-    sb = faidx.SeqBuf(chrm, beg)
+    if beg <= 1:
+        return beg, end
+
+    dlen = end - beg + 1
+    w = 64
     while True:
-        if beg <= 1:
-            break
-        left_base = sb.get_base(chrm, beg-1)
-        rightmost = sb.get_base(chrm, end)
-        if left_base == 'N' or rightmost == 'N':
+        lo = max(1, beg-w)
+        seq = fetch(lo, end)
+        k = _match_left(seq[:-dlen], seq[dlen:], stop)
+        if k < beg - lo or lo == 1:
             break
-        if left_base != rightmost:
-            break
-        beg -= 1
-        end -= 1
+        w <<= 2
 
-    return beg, end
+    return beg-k, end-k
 
-def gnuc_roll_right_del(chrm, beg, end):
+def roll_right_del(fetch, beg, end, last, stop='N'):
 
     """ beg and end are 1st and last base in the deleted sequence """
 
-    sb = faidx.SeqBuf(chrm, end)
-    chrmlen = faidx.refgenome.chrm2len(chrm)
+    if end >= last:
+        return beg, end
+
+    dlen = end - beg + 1
+    w = 64
     while True:
-        # check end of chromosome
-        if end + 1 >= chrmlen:
+        hi = min(last, end+w)
+        seq = fetch(beg, hi)
+        k = _match_right(seq[:-dlen], seq[dlen:], stop)
+        if k < hi - end or hi == last:
             break
+        w <<= 2
 
-        right_base = sb.get_base(chrm, end+1)
-        leftmost = sb.get_base(chrm, beg)
-        if right_base == 'N' or leftmost == 'N':
-            break
-        if right_base != leftmost:
+    return beg+k, end+k
+
+def roll_left_ins(fetch, pos, insseq, stop='N'):
+
+    """ pos is where insertion occur after """
+
+    if pos <= 1 or not insseq:
+        return pos, insseq
+
+    ilen = len(insseq)
+    w = 64
+    while True:
+        lo = max(1, pos-w)
+        n = pos - lo + 1
+        seq = fetch(lo, pos) + insseq
+        k = _match_left(seq[:n], seq[ilen:], stop)
+        if k < n or lo == 1:
             break
-        beg += 1
-        end += 1
+        w <<= 2
 
-    return beg, end
+    k = min(k, pos-1)
+    return pos-k, seq[n-k:n-k+ilen]
 
-def gnuc_roll_left_ins(chrm, pos, gnuc_insseq):
+def roll_right_ins(fetch, pos, insseq, last, stop='N'):
 
     """ pos is where insertion occur after """
 
-    sb = faidx.SeqBuf(chrm, pos)
-    _gnuc_insseq_ = deque(gnuc_insseq)
+    if pos >= last or not insseq:
+        return pos, insseq
+
+    ilen = len(insseq)
+    w = 64
     while True:
-        if pos <= 1:
-            break
-        left_base = sb.get_base(chrm, pos)
-        rightmost = _gnuc_insseq_[-1]
-        if left_base == 'N' or rightmost == 'N':
-            break
-        if left_base != rightmost:
+        hi = min(last, pos+w)
+        seq = insseq + fetch(pos+1, hi)
+        k = _match_right(seq[:-ilen], seq[ilen:], stop)
+        if k < hi - pos or hi == last:
             break
-        _gnuc_insseq_.pop()
-        _gnuc_insseq_.appendleft(left_base)
-        pos -= 1
+        w <<= 2
 
-    return pos, ''.join(_gnuc_insseq_)
+    return pos+k, seq[k:k+ilen]
+
+def gnuc_roll_left_del(chrm, beg, end):
+
+    """ beg and end are 1st and last base in the deleted sequence """
+
+    return roll_left_del(lambda b, e: faidx.getseq(chrm, b, e), beg, end)
+
+def gnuc_roll_right_del(chrm, beg, end):
+
+    """ beg and end are 1st and last base in the deleted sequence """
+
+    chrmlen = faidx.refgenome.chrm2len(chrm)
+    return roll_right_del(lambda b, e: faidx.getseq(chrm, b, e), beg, end, chrmlen-1)
+
+def gnuc_roll_left_ins(chrm, pos, gnuc_insseq):
+
+    """ pos is where insertion occur after """
+
+    return roll_left_ins(lambda b, e: faidx.getseq(chrm, b, e), pos, gnuc_insseq)
 
 def gnuc_roll_right_ins(chrm, pos, gnuc_insseq):
 
     """ pos is where insertion occur after """
 
-    sb = faidx.SeqBuf(chrm, pos)
     chrmlen = faidx.refgenome.chrm2len(chrm)
-    _gnuc_insseq_ = deque(gnuc_insseq)
-    while True:
-        if pos + 1 >= chrmlen:
-            break
-        right_base = sb.get_base(chrm, pos+1)
-        leftmost = _gnuc_insseq_[0]
-        if right_base == 'N' or leftmost == 'N':
-            break
-        if right_base != leftmost:
-            break
-        _gnuc_insseq_.popleft()
-        _gnuc_insseq_.append(right_base)
-        pos += 1
-
-    return pos, ''.join(_gnuc_insseq_)
+    return roll_right_ins(lambda b, e: faidx.getseq(chrm, b, e), pos, gnuc_insseq, chrmlen-1)
 
 class NucInsertion():
 
@@ -1417,7 +1525,11 @@ def _old_tnuc_set_ins(r, t, p, tnuc_insseq):
         r.append_info('left_align_cDNA=c.%d_%dins%s' % (p1l, p1l+1, tnuc_insseq_l))
         r.append_info('unalign_cDNA=c.%s_%sins%s' % (p1, p1+1, tnuc_insseq))
 
-class Gene():
+class Gene(object):
+
+    # beg, end, gene_t and _gene_id are only set by the GFF parsers
+    __slots__ = ('gene_type', 'name', 'dbxref', 'tpts', 'std_tpt', 'pseudo',
+                 'aliases', 'beg', 'end', 'gene_t', '_gene_id')
 
     def __init__(self, name='', gene_type='protein_coding'):
 
@@ -1484,14 +1596,15 @@ def translate_seq(seq):
     if len(seq) % 3 != 0:
         raise IncompatibleTranscriptError('coding_sequence_not_multiplicative_of_3;length_%d' % len(seq))
 
-    aa_seq = []
-    for i in range(len(seq)//3):
-        aa = codon2aa(seq[i*3:i*3+3])
-        aa_seq.append(aa)
-        if aa == '*':
-            break
+    aa_seq = translate_codons(seq)
+    i = aa_seq.find('*')
+    if i >= 0:
+        aa_seq = aa_seq[:i+1]
+    i = aa_seq.find('?')
+    if i >= 0:
+        codon2aa(seq[i*3:i*3+3]) # raise on the first invalid codon
 
-    return ''.join(aa_seq)
+    return aa_seq
 
 class Region():
 